@@ -7,6 +7,14 @@ import sys
 import importlib
 import pathlib
 import matplotlib.pyplot as plt
+from src.controller_worker import ControllerWorker
+
+# python3 run.py --worker runs the controller in a separate process with a
+# deadline every control period, see src/controller_worker.py
+worker = None
+if "--worker" in sys.argv:
+    # started before the environment so the worker does not inherit pygame
+    worker = ControllerWorker("controller.py")
 
 
 targets = []
@@ -79,6 +87,8 @@ def reload():
     # re importing the controller module without closing the program
     try:
         importlib.reload(controller)
+        if worker is not None:
+            worker.reload()
         environment.reset(controller.group_number, controller.wind_active)
 
     except Exception as e:
@@ -124,6 +134,13 @@ time_list = []
 
 
 
+def stop_worker():
+    # print the deadline statistics of the controller worker, if any
+    if worker is not None:
+        print(worker.stats())
+        worker.close()
+
+
 #PLOTTING ON CLOSE BELOW================================================
 # Create a figure and axis object for the plot
 fig, ax = plt.subplots(figsize=(12, 6))
@@ -146,6 +163,7 @@ while running:
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
+            stop_worker()
             pygame.quit()
             sys.exit()
         if event.type == pygame_gui.UI_BUTTON_PRESSED:
@@ -162,10 +180,13 @@ while running:
 
         manager.process_events(event)
 
-    # Get the state of the drone
-    state = environment.drone.get_state()
+    # Get the state of the drone, as the sensors see it
+    state = environment.observe()
     # Call the controller function
-    action = check_action(controller.controller(state, target_pos, 1 / 60))
+    if worker is not None:
+        action = worker(state, target_pos, 1 / 60)
+    else:
+        action = check_action(controller.controller(state, target_pos, 1 / 60))
         
     environment.step(action)
 
@@ -216,6 +237,7 @@ while running:
     
     # Optional: Stop the loop after a certain number of iterations
     if len(time_list) == 1200:
+        stop_worker()
         pygame.quit()
         sys.exit()
     # Plotting on Close Above=================================================
@@ -0,0 +1,166 @@
+# step response metrics for batches of recorded flights
+#
+# every metric is computed for N runs at once, without looping over
+# runs in python. Inputs follow the layout of the error lists in run.py:
+#   error     -> (N, T) or (N, T, A) position error (position - target)
+#   attitude  -> (N, T) drone attitude in radians
+#   actions   -> (N, T, 2) motor commands sent to Drone.step
+#
+# runs are processed in chunks so that the temporaries stay bounded for
+# tens of thousands of runs.
+import numpy as np
+
+METRICS = (
+    "rise_time",
+    "overshoot",
+    "settling_time",
+    "steady_state_error",
+    "iae",
+    "itae",
+)
+
+
+def _first_index(mask):
+    # index of the first True along the time axis (axis 1), -1 if none
+    index = np.argmax(mask, axis=1)
+    return np.where(mask.any(axis=1), index, -1)
+
+
+def _last_index(mask):
+    # index of the last True along the time axis (axis 1), -1 if none
+    index = mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+    return np.where(mask.any(axis=1), index, -1)
+
+
+def _error_metrics(error, dt, rise, settling_band, steady_state_samples):
+    T = error.shape[1]
+    t = np.arange(T) * dt
+    e0 = error[:, :1]
+    valid = e0[:, 0] != 0
+
+    abs_error = np.abs(error)
+    # fraction of the initial error that has been removed, 0 at t=0 and 1 on target
+    progress = 1 - error / np.where(e0 != 0, e0, 1)
+
+    low = _first_index(progress >= rise[0])
+    high = _first_index(progress >= rise[1])
+    rise_time = np.where((low >= 0) & (high >= 0) & valid, (high - low) * dt, np.nan)
+
+    overshoot = np.where(valid, np.maximum(progress.max(axis=1) - 1, 0) * 100, np.nan)
+
+    outside = abs_error > settling_band * np.abs(e0)
+    last_outside = _last_index(outside)
+    settling_time = np.where(last_outside == T - 1, np.nan, (last_outside + 1) * dt)
+    settling_time = np.where(valid, settling_time, np.nan)
+
+    return {
+        "rise_time": rise_time,
+        "overshoot": overshoot,
+        "settling_time": settling_time,
+        "steady_state_error": error[:, T - steady_state_samples :].mean(axis=1),
+        "iae": abs_error.sum(axis=1) * dt,
+        "itae": abs_error @ t * dt,
+    }
+
+
+def step_response_metrics(
+    error,
+    dt=1.0 / 60,
+    attitude=None,
+    actions=None,
+    rise=(0.1, 0.9),
+    settling_band=0.02,
+    steady_state_window=0.1,
+    action_limits=(0.0, 1.0),
+    chunk_size=4096,
+):
+    """Compute step response metrics for a batch of runs.
+
+    Args:
+        error (np.ndarray): (N, T) or (N, T, A) position error per run and axis
+        dt (float, optional): sample time. Defaults to 1/60.
+        attitude (np.ndarray, optional): (N, T) attitude in radians
+        actions (np.ndarray, optional): (N, T, 2) motor commands
+        rise (tuple, optional): fractions of the initial error used for the rise time
+        settling_band (float, optional): settling band relative to the initial error
+        steady_state_window (float, optional): fraction of the run averaged for
+            the steady state error
+        action_limits (tuple, optional): commands at or beyond these count as saturated
+        chunk_size (int, optional): number of runs processed at once
+
+    Returns:
+        dict: arrays of shape (N,) or (N, A). Rise and settling times are in
+        seconds and NaN when the run never gets there, overshoot is in percent
+        of the initial error.
+    """
+    error = np.asarray(error)
+    squeeze = error.ndim == 2
+    if squeeze:
+        error = error[:, :, None]
+    n, T, axes = error.shape
+    steady_state_samples = max(1, int(round(T * steady_state_window)))
+
+    results = {name: np.empty((n, axes)) for name in METRICS}
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        for axis in range(axes):
+            chunk = _error_metrics(
+                error[start:stop, :, axis].astype(float),
+                dt,
+                rise,
+                settling_band,
+                steady_state_samples,
+            )
+            for name in METRICS:
+                results[name][start:stop, axis] = chunk[name]
+
+    if squeeze:
+        results = {name: value[:, 0] for name, value in results.items()}
+
+    if attitude is not None:
+        results["max_attitude"] = np.abs(attitude).max(axis=1)
+
+    if actions is not None:
+        actions = np.asarray(actions)
+        saturated = (actions <= action_limits[0]) | (actions >= action_limits[1])
+        results["saturation_fraction"] = saturated.reshape(n, -1).mean(axis=1)
+
+    return results
+
+
+def rank_runs(metrics, weights=None):
+    """Order runs from best to worst by a weighted sum of normalized metrics.
+
+    Every metric is divided by its median over the batch so that the
+    weights are unitless. Runs with a NaN metric (never settled, never rose)
+    are ranked last.
+
+    Args:
+        metrics (dict): output of step_response_metrics
+        weights (dict, optional): weight per metric name. Defaults to equal
+            weights on settling time, overshoot, ITAE and steady state error.
+
+    Returns:
+        tuple: (order, score), the run indices sorted best first and the
+        score of every run
+    """
+    if weights is None:
+        weights = {
+            "settling_time": 1.0,
+            "overshoot": 1.0,
+            "itae": 1.0,
+            "steady_state_error": 1.0,
+        }
+
+    score = 0
+    for name, weight in weights.items():
+        value = np.abs(metrics[name])
+        if value.ndim > 1:
+            value = value.sum(axis=tuple(range(1, value.ndim)))
+        scale = np.nanmedian(value)
+        if not np.isfinite(scale) or scale == 0:
+            scale = 1
+        score = score + weight * value / scale
+
+    score = np.where(np.isnan(score), np.inf, score)
+    return np.argsort(score, kind="stable"), score
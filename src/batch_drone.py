@@ -0,0 +1,238 @@
+# NumPy version of Drone and Rotor for N drones at once
+#
+# step() applies the same semi-implicit Euler update as Drone.step, in the
+# same order of operations, so a BatchDrone of one drone follows a Drone to
+# within floating point rounding. Airframe parameters may differ per drone.
+import numpy as np
+
+GRAVITY = 9.81
+
+
+class BatchDrone:
+    def __init__(
+        self,
+        n,
+        mass,
+        rotational_inertia,
+        drag_coefficient,
+        reference_area,
+        thrust_coefficient,
+        rotor_time_constant,
+        rotor_constant,
+        omega_b,
+        air_density=1.225,
+        arm_length=0.25,
+    ):
+        self.n = n
+
+        def per_drone(value):
+            return np.broadcast_to(np.asarray(value, dtype=float), (n,)).copy()
+
+        self.mass = per_drone(mass)
+        self.rotational_inertia = per_drone(rotational_inertia)
+        self.drag_coefficient = per_drone(drag_coefficient)
+        self.reference_area = per_drone(reference_area)
+        self.thrust_coefficient = per_drone(thrust_coefficient)
+        self.rotor_time_constant = per_drone(rotor_time_constant)
+        self.rotor_constant = per_drone(rotor_constant)
+        self.omega_b = per_drone(omega_b)
+        self.air_density = air_density
+        self.arm_length = arm_length
+
+        self.position = np.zeros((n, 2))
+        self.velocity = np.zeros((n, 2))
+        self.attitude = np.zeros(n)
+        self.angular_velocity = np.zeros(n)
+        self.rotor_speed = np.zeros((n, 2))
+        self.last_action = np.zeros((n, 2))
+        self._work = None
+
+    @classmethod
+    def from_parameters(cls, parameters, n=None):
+        """Build from Environment.setup_drone_parameters output.
+
+        Args:
+            parameters (tuple | list): one parameter tuple shared by all drones,
+                or a list with one tuple per drone
+            n (int, optional): number of drones when a single tuple is given
+        """
+        if isinstance(parameters, tuple):
+            n = 1 if n is None else n
+            rows = [parameters]
+        else:
+            rows = list(parameters)
+            n = len(rows)
+
+        columns = list(zip(*rows))
+        drones = cls(n, *[np.array(c, dtype=float) for c in columns[4:]])
+        position = np.array([(p[0][0], p[0][1]) for p in rows])
+        velocity = np.array([(p[1][0], p[1][1]) for p in rows])
+        drones.position[:] = position
+        drones.velocity[:] = velocity
+        drones.attitude[:] = columns[2]
+        drones.angular_velocity[:] = columns[3]
+        return drones
+
+    def set_state(self, states, rotor_speed=0):
+        # states in get_state() order, (N, 6) or one (6,) state for all drones
+        states = np.broadcast_to(np.asarray(states, dtype=float), (self.n, 6))
+        self.position[:] = states[:, 0:2]
+        self.velocity[:] = states[:, 2:4]
+        self.attitude[:] = states[:, 4]
+        self.angular_velocity[:] = states[:, 5]
+        self.rotor_speed[:] = rotor_speed
+        self.last_action[:] = 0
+
+    def get_state(self):
+        # (N, 6) array in Drone.get_state() order
+        return np.column_stack(
+            (self.position, self.velocity, self.attitude, self.angular_velocity)
+        )
+
+    def step(self, actions, dt, wind=None, force=None, torque=None):
+        """Advance every drone by one time step.
+
+        Args:
+            actions (np.ndarray): (N, 2) motor commands, clamped to [0, 1]
+            dt (float): time step
+            wind (np.ndarray, optional): (N, 2) or (2,) wind vector
+            force (np.ndarray, optional): (N, 2) or (2,) external force in N
+            torque (np.ndarray, optional): (N,) or scalar external torque in N m
+        """
+        # component-wise 1D operations are much cheaper than broadcasting
+        # over the short second axis, so the update is written per component,
+        # in place into preallocated buffers and in the order of Drone.step
+        u = self.last_action
+        np.minimum(actions, 1, out=u)
+        np.maximum(u, 0, out=u)
+        (
+            thrust_1,
+            thrust_2,
+            total,
+            rx,
+            ry,
+            magnitude,
+            drag_x,
+            drag_y,
+            work,
+        ) = self._scratch()
+
+        # Rotor.set_throttle and Rotor.step
+        for i, thrust in enumerate((thrust_1, thrust_2)):
+            speed = self.rotor_speed[:, i]
+            np.multiply(u[:, i], self.rotor_constant, out=work)
+            work += self.omega_b
+            work -= speed
+            work /= self.rotor_time_constant
+            work *= dt
+            speed += work
+            np.multiply(speed, speed, out=work)
+            np.multiply(self.thrust_coefficient, work, out=thrust)
+        np.add(thrust_1, thrust_2, out=total)
+
+        # quadratic drag on the air relative velocity
+        vx = self.velocity[:, 0]
+        vy = self.velocity[:, 1]
+        if wind is None:
+            rx[:] = vx
+            ry[:] = vy
+        else:
+            wind = np.asarray(wind)
+            np.subtract(vx, wind[..., 0], out=rx)
+            np.subtract(vy, wind[..., 1], out=ry)
+        np.multiply(rx, rx, out=magnitude)
+        np.multiply(ry, ry, out=work)
+        magnitude += work
+        np.sqrt(magnitude, out=magnitude)
+        # drag magnitude, left in work
+        np.multiply(0.5, self.drag_coefficient, out=work)
+        work *= self.reference_area
+        work *= self.air_density
+        for r, drag in ((rx, drag_x), (ry, drag_y)):
+            np.multiply(magnitude, magnitude, out=drag)
+            drag *= work
+        if magnitude.all():
+            for r, drag in ((rx, drag_x), (ry, drag_y)):
+                np.divide(r, magnitude, out=r)
+                np.negative(r, out=r)
+                drag *= r
+        else:
+            moving = magnitude != 0
+            safe = np.where(moving, magnitude, 1)
+            for r, drag in ((rx, drag_x), (ry, drag_y)):
+                np.copyto(drag, np.where(moving, drag * -(r / safe), 0))
+
+        if force is not None:
+            force = np.asarray(force)
+            drag_x += force[..., 0]
+            drag_y += force[..., 1]
+        # rx and ry are free again, thrust_x and thrust_y in them
+        np.sin(self.attitude, out=rx)
+        rx *= total
+        np.cos(self.attitude, out=ry)
+        np.negative(ry, out=ry)
+        ry *= total
+        rx /= self.mass
+        np.divide(drag_x, self.mass, out=work)
+        rx += work
+        rx *= dt
+        vx += rx
+        ry /= self.mass
+        ry += GRAVITY
+        np.divide(drag_y, self.mass, out=work)
+        ry += work
+        ry *= dt
+        vy += ry
+        np.multiply(vx, dt, out=work)
+        self.position[:, 0] += work
+        np.multiply(vy, dt, out=work)
+        self.position[:, 1] += work
+
+        # rotor torque and angular acceleration, in thrust_1
+        thrust_1 -= thrust_2
+        thrust_1 *= self.arm_length
+        if torque is not None:
+            thrust_1 += torque
+        thrust_1 /= self.rotational_inertia
+        thrust_1 *= dt
+        self.angular_velocity += thrust_1
+        np.multiply(self.angular_velocity, dt, out=work)
+        self.attitude += work
+
+        # same wrap as Drone.step
+        np.abs(self.attitude, out=work)
+        if work.max() > np.pi:
+            wrap = work > np.pi
+            wrapped = self.attitude[wrap]
+            self.attitude[wrap] = np.where(
+                wrapped > 0,
+                -np.pi + np.fmod(wrapped, np.pi),
+                np.pi + np.fmod(wrapped, np.pi),
+            )
+
+    def _scratch(self):
+        # (9, N) work rows of step(), reallocated after compress()
+        if self._work is None or self._work.shape[1] != self.n:
+            self._work = np.empty((9, self.n))
+        return self._work
+
+    def compress(self, keep):
+        # keep only the drones selected by a boolean mask or index array
+        for name in (
+            "mass",
+            "rotational_inertia",
+            "drag_coefficient",
+            "reference_area",
+            "thrust_coefficient",
+            "rotor_time_constant",
+            "rotor_constant",
+            "omega_b",
+            "position",
+            "velocity",
+            "attitude",
+            "angular_velocity",
+            "rotor_speed",
+            "last_action",
+        ):
+            setattr(self, name, getattr(self, name)[keep])
+        self.n = len(self.mass)
@@ -0,0 +1,262 @@
+# batched closed loop simulation with early termination
+#
+# N runs of BatchDrone flown by BatchPID (a vectorized copy of
+# controller.controller) until each run either crashes, leaves the arena,
+# diverges, settles on its target for a dwell time, or reaches the end.
+# Finished runs are dropped from the active arrays every few steps, so the
+# cost of a step shrinks as the batch progresses.
+import numpy as np
+
+# termination reasons
+TIMEOUT = 0
+GROUND = 1
+WALL = 2
+OUT_OF_BOUNDS = 3
+DIVERGED = 4
+SETTLED = 5
+REASONS = ("timeout", "ground", "wall", "out_of_bounds", "diverged", "settled")
+
+
+class BatchPID:
+    # controller.controller for N drones, same gains, clamps and integrators
+    def __init__(
+        self,
+        n,
+        kp_y=63.5,
+        ki_y=62,
+        kd_y=30,
+        kp_x=0.1631,
+        ki_x=0.05607,
+        kd_x=0.2345,
+        kp_phi=50,
+        ki_phi=0.35,
+        kd_phi=20,
+        max_pitch_angle=10 * (3.14159 / 180),
+        max_action=0.75,
+    ):
+        """
+        Args:
+            n (int): number of drones
+            kp_y ... kd_phi (float | np.ndarray, optional): gains, scalars or
+                (n,) arrays for gain sweeps. Defaults are those of controller.py
+        """
+        self.n = n
+
+        def per_drone(value):
+            return np.broadcast_to(np.asarray(value, dtype=float), (n,)).copy()
+
+        self.kp_y = per_drone(kp_y)
+        self.ki_y = per_drone(ki_y)
+        self.kd_y = per_drone(kd_y)
+        self.kp_x = per_drone(kp_x)
+        self.ki_x = per_drone(ki_x)
+        self.kd_x = per_drone(kd_x)
+        self.kp_phi = per_drone(kp_phi)
+        self.ki_phi = per_drone(ki_phi)
+        self.kd_phi = per_drone(kd_phi)
+        self.max_pitch_angle = max_pitch_angle
+        self.max_action = max_action
+        self.reset()
+
+    def reset(self):
+        self.e_int_y = np.zeros(self.n)
+        self.e_int_x = np.zeros(self.n)
+        self.e_int_phi = np.zeros(self.n)
+
+    def __call__(self, states, targets, dt):
+        """
+        Args:
+            states (np.ndarray): (N, 6) states in Drone.get_state() order
+            targets (np.ndarray): (N, 2) or (2,) target positions
+
+        Returns:
+            tuple: (actions (N, 2), errors (N, 2)), the errors being
+            (err_x, err_y) as returned by controller.controller
+        """
+        targets = np.asarray(targets, dtype=float)
+        x, y, vx, vy, phi, phidot = states.T
+        err_y = y - targets[..., 1]
+        err_x = x - targets[..., 0]
+
+        self.e_int_y = np.clip(self.e_int_y + err_y * dt, -0.15, 0.15)
+        self.e_int_x = np.clip(self.e_int_x + err_x * dt, -0.085, 0.085)
+
+        phi_c = -1 * (self.kd_x * vx + self.kp_x * err_x + self.ki_x * self.e_int_x)
+        phi_c = np.clip(phi_c, -self.max_pitch_angle, self.max_pitch_angle)
+
+        err_phi = phi - phi_c
+        self.e_int_phi = np.clip(self.e_int_phi + err_phi * dt, -0.15, 0.15)
+
+        force = self.kd_y * vy + self.kp_y * err_y + self.ki_y * self.e_int_y
+        moment = (
+            self.kd_phi * phidot + self.kp_phi * err_phi + self.ki_phi * self.e_int_phi
+        )
+
+        actions = np.empty((len(states), 2))
+        actions[:, 0] = np.clip(force - moment, 0, self.max_action)
+        actions[:, 1] = np.clip(force + moment, 0, self.max_action)
+        return actions, np.stack([err_x, err_y], axis=1)
+
+    def compress(self, keep):
+        # keep only the drones selected by a boolean mask or index array
+        for name in (
+            "kp_y",
+            "ki_y",
+            "kd_y",
+            "kp_x",
+            "ki_x",
+            "kd_x",
+            "kp_phi",
+            "ki_phi",
+            "kd_phi",
+            "e_int_y",
+            "e_int_x",
+            "e_int_phi",
+        ):
+            setattr(self, name, getattr(self, name)[keep])
+        self.n = len(self.e_int_y)
+
+
+def box_bounds(drones, width_px=50, height_px=10):
+    # axis aligned bounds of the rotated Drone.box, in metres
+    cos = np.abs(np.cos(drones.attitude))
+    sin = np.abs(np.sin(drones.attitude))
+    half_x = (cos * width_px + sin * height_px) / 200
+    half_y = (sin * width_px + cos * height_px) / 200
+    x = drones.position[:, 0]
+    y = drones.position[:, 1]
+    return x - half_x, x + half_x, y - half_y, y + half_y
+
+
+def simulate(
+    drones,
+    controller,
+    targets,
+    duration=20.0,
+    dt=1.0 / 60,
+    wind=None,
+    arena=(0.0, 8.0),
+    settle_tolerance=0.05,
+    settle_speed=0.1,
+    dwell_time=1.0,
+    max_speed=50.0,
+    max_angular_velocity=100.0,
+    compact_every=30,
+    record=False,
+):
+    """Fly a batch until every run has terminated or the duration is over.
+
+    The ground and wall checks match Drone.check_collision against the edges
+    of the arena (away from its corners): a run ends when its box touches or
+    straddles an edge, the bottom one counting as ground. Runs that end up beyond an edge without
+    touching it (too fast for one step) are out of bounds. The drones and controller are modified in
+    place and compacted, so pass copies if they are needed afterwards.
+
+    Args:
+        drones (BatchDrone): initial states and airframes of the N runs
+        controller (BatchPID): controller with N integrator states
+        targets (np.ndarray): (N, 2) or (2,) target positions
+        wind (np.ndarray, optional): (N, 2) or (2,) constant wind
+        settle_tolerance (float, optional): position error in metres within
+            which a run counts as settled
+        settle_speed (float, optional): speed below which a run counts as settled
+        dwell_time (float, optional): time a run must stay settled to terminate
+        max_speed (float, optional): speed beyond which a run has diverged
+        max_angular_velocity (float, optional): angular velocity beyond which
+            a run has diverged
+        compact_every (int, optional): steps between compactions
+        record (bool, optional): keep the (N, T, 2) position errors, held at
+            their last value after termination, for analysis.step_response_metrics
+
+    Returns:
+        dict: reason (N,) termination reason codes, step (N,) step at which
+        each run terminated, states (N, 6) final states and, with record,
+        errors (N, T, 2)
+    """
+    n = drones.n
+    steps = int(round(duration / dt))
+    low, high = arena
+    targets = np.broadcast_to(np.asarray(targets, dtype=float), (n, 2)).copy()
+    wind = None if wind is None else np.asarray(wind, dtype=float)
+    per_run_wind = wind is not None and wind.ndim == 2
+    dwell_steps = int(round(dwell_time / dt))
+
+    reason = np.full(n, TIMEOUT)
+    step = np.full(n, steps)
+    final_states = np.empty((n, 6))
+    errors = np.full((n, steps, 2), np.nan) if record else None
+
+    index = np.arange(n)  # original run of every active slot
+    finished = np.zeros(n, dtype=bool)
+    settled_for = np.zeros(n, dtype=int)
+
+    for k in range(steps):
+        actions, error = controller(drones.get_state(), targets, dt)
+        drones.step(actions, dt, wind)
+        if record:
+            errors[index[~finished], k] = error[~finished]
+
+        # termination checks on the active slots, later checks take priority
+        x = drones.position[:, 0]
+        y = drones.position[:, 1]
+        vx = drones.velocity[:, 0]
+        vy = drones.velocity[:, 1]
+        speed = np.sqrt(vx * vx + vy * vy)
+        min_x, max_x, min_y, max_y = box_bounds(drones)
+
+        new_reason = np.full(len(x), -1)
+        outside = (x < low) | (x > high) | (y < low) | (y > high)
+        new_reason[outside] = OUT_OF_BOUNDS
+        # a box touching or straddling an edge line collides with that wall
+        wall = (
+            ((min_x <= low) & (max_x >= low))
+            | ((min_x <= high) & (max_x >= high))
+            | ((min_y <= low) & (max_y >= low))
+        )
+        new_reason[wall] = WALL
+        new_reason[(min_y <= high) & (max_y >= high)] = GROUND
+        diverged = (
+            ~np.isfinite(speed + drones.angular_velocity)
+            | (speed > max_speed)
+            | (np.abs(drones.angular_velocity) > max_angular_velocity)
+        )
+        new_reason[diverged] = DIVERGED
+
+        close = (np.abs(error[:, 0]) < settle_tolerance) & (
+            np.abs(error[:, 1]) < settle_tolerance
+        )
+        settled_for = np.where(close & (speed < settle_speed), settled_for + 1, 0)
+        new_reason[(new_reason < 0) & (settled_for >= dwell_steps)] = SETTLED
+
+        terminated = (new_reason >= 0) & ~finished
+        if terminated.any():
+            runs = index[terminated]
+            reason[runs] = new_reason[terminated]
+            step[runs] = k + 1
+            final_states[runs] = drones.get_state()[terminated]
+            finished |= terminated
+
+        if finished.all():
+            break
+        if (k + 1) % compact_every == 0 and finished.any():
+            keep = ~finished
+            drones.compress(keep)
+            controller.compress(keep)
+            targets = targets[keep]
+            if per_run_wind:
+                wind = wind[keep]
+            index = index[keep]
+            settled_for = settled_for[keep]
+            finished = finished[keep]
+
+    running = ~finished
+    final_states[index[running]] = drones.get_state()[running]
+    result = {"reason": reason, "step": step, "states": final_states}
+    if record:
+        # hold the last error of finished runs so the metrics stay defined
+        last = np.maximum(step - 1, 0)[:, None, None]
+        held = np.take_along_axis(errors, np.broadcast_to(last, (n, 1, 2)), axis=1)
+        after = np.arange(steps)[None, :] >= step[:, None]
+        errors[after] = np.broadcast_to(held, errors.shape)[after]
+        result["errors"] = errors
+    return result
@@ -0,0 +1,246 @@
+# run controller.controller in a separate process with a deadline per period
+#
+# the state, target and dt go to the worker through a small shared memory
+# block and the motor commands come back the same way, with sequence numbers
+# so late answers to older requests are ignored. If the worker does not
+# answer before the deadline, the last command is held and the miss is
+# counted, so a slow, hung or crashing controller never blocks the physics
+# and rendering loop. A miss records the time waited as its latency. The
+# worker writes the compute time of every request it runs to a shared ring
+# indexed by seq, so slow answers that miss their deadline are still counted.
+import importlib.util
+import multiprocessing
+import time
+import traceback
+from multiprocessing import shared_memory
+import numpy as np
+
+# layout of the shared float64 block
+REQUEST_SEQ = 0
+REQUEST_STATE = slice(1, 7)
+REQUEST_TARGET = slice(7, 9)
+REQUEST_DT = 9
+REQUEST_RELOAD = 10
+REQUEST_STOP = 11
+RESPONSE_SEQ = 12
+RESPONSE_ACTION = slice(13, 17)
+RESPONSE_STATUS = 17
+BLOCK_SIZE = 18
+# followed by a ring of max_records compute times, slot (seq - 1) % max_records
+
+# response status codes
+OK = 0
+INVALID = 1
+ERROR = 2
+
+
+def load_controller(path):
+    # import the controller file as a fresh module object
+    spec = importlib.util.spec_from_file_location("controller", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def validate_action(action):
+    # the same contract as run.check_action: four numbers (u1, u2, err_x, err_y)
+    if not isinstance(action, (tuple, list)) or len(action) != 4:
+        return None
+    try:
+        return [float(value) for value in action]
+    except (TypeError, ValueError):
+        return None
+
+
+def worker_main(shm_name, path, request, response, max_records):
+    # entry point of the worker process
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray((BLOCK_SIZE,), dtype=np.float64, buffer=shm.buf)
+    compute_times = np.ndarray(
+        (max_records,), dtype=np.float64, buffer=shm.buf, offset=BLOCK_SIZE * 8
+    )
+    module = load_controller(path)
+    try:
+        while True:
+            request.wait()
+            request.clear()
+            if block[REQUEST_STOP]:
+                break
+
+            # seqlock read, the parent zeroes the sequence number while writing
+            while True:
+                seq = block[REQUEST_SEQ]
+                state = block[REQUEST_STATE].tolist()
+                target = block[REQUEST_TARGET].tolist()
+                dt = block[REQUEST_DT]
+                reload = block[REQUEST_RELOAD]
+                if seq != 0 and block[REQUEST_SEQ] == seq:
+                    break
+
+            if reload:
+                block[REQUEST_RELOAD] = 0
+                try:
+                    module = load_controller(path)
+                except BaseException:
+                    print("Error reloading " + str(path))
+                    traceback.print_exc()
+
+            start = time.perf_counter()
+            try:
+                action = validate_action(module.controller(state, target, dt))
+                status = OK if action is not None else INVALID
+            except BaseException:
+                # SystemExit too, run.check_action calls sys.exit()
+                traceback.print_exc()
+                action, status = None, ERROR
+            compute_time = time.perf_counter() - start
+
+            # recorded even if the parent stopped waiting for this answer
+            compute_times[(int(seq) - 1) % max_records] = compute_time
+            if action is not None:
+                block[RESPONSE_ACTION] = action
+            block[RESPONSE_STATUS] = status
+            block[RESPONSE_SEQ] = seq
+            response.set()
+    finally:
+        del block, compute_times
+        shm.close()
+
+
+class ControllerWorker:
+    def __init__(self, path="controller.py", deadline=0.008, max_records=100000):
+        """
+        Args:
+            path (str, optional): controller file defining controller(state, target_pos, dt)
+            deadline (float, optional): seconds the worker has to answer each
+                request, keep it below the control period
+            max_records (int, optional): number of latencies kept for stats()
+        """
+        self.path = str(path)
+        self.deadline = deadline
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=(BLOCK_SIZE + max_records) * 8
+        )
+        self.block = np.ndarray((BLOCK_SIZE,), dtype=np.float64, buffer=self.shm.buf)
+        self.block[:] = 0
+        # written by the worker, NaN for requests it never ran
+        self.compute_time = np.ndarray(
+            (max_records,), dtype=np.float64, buffer=self.shm.buf, offset=BLOCK_SIZE * 8
+        )
+        self.compute_time[:] = np.nan
+
+        # fork where available: spawn re-imports the calling script, and
+        # run.py has no main guard. Create the worker before pygame.init()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        self.request = context.Event()
+        self.response = context.Event()
+        self.process = context.Process(
+            target=worker_main,
+            args=(self.shm.name, self.path, self.request, self.response, max_records),
+            daemon=True,
+        )
+        self.process.start()
+
+        self.seq = 0
+        self.last_action = (0.0, 0.0)
+        self.calls = 0
+        self.misses = 0
+        self.invalid = 0
+        self.errors = 0
+        self.latency = np.full(max_records, np.nan)
+
+    def __call__(self, state, target_pos, dt):
+        """Request the next command and wait at most the deadline for it.
+
+        Returns:
+            tuple: (u1, u2, err_x, err_y). On a miss or an invalid answer the
+            previous motor commands are held and the errors are computed here.
+        """
+        block = self.block
+        self.seq += 1
+        index = (self.seq - 1) % len(self.latency)
+        self.compute_time[index] = np.nan
+        self.response.clear()
+        block[REQUEST_SEQ] = 0
+        block[REQUEST_STATE] = state
+        block[REQUEST_TARGET] = target_pos
+        block[REQUEST_DT] = dt
+        block[REQUEST_SEQ] = self.seq
+        start = time.perf_counter()
+        self.request.set()
+
+        self.calls += 1
+        end = start + self.deadline
+        answered = False
+        while True:
+            remaining = end - time.perf_counter()
+            if remaining <= 0 or not self.response.wait(remaining):
+                break
+            self.response.clear()
+            # an answer to an older request may arrive first, keep waiting
+            if block[RESPONSE_SEQ] == self.seq:
+                answered = True
+                break
+
+        self.latency[index] = time.perf_counter() - start
+        err_x = state[0] - target_pos[0]
+        err_y = state[1] - target_pos[1]
+        if not answered:
+            self.misses += 1
+            return (*self.last_action, err_x, err_y)
+
+        status = int(block[RESPONSE_STATUS])
+        if status != OK:
+            if status == INVALID:
+                self.invalid += 1
+            else:
+                self.errors += 1
+            return (*self.last_action, err_x, err_y)
+
+        u1, u2, err_x, err_y = block[RESPONSE_ACTION].tolist()
+        self.last_action = (u1, u2)
+        return u1, u2, err_x, err_y
+
+    def reload(self):
+        # the worker re-imports the controller file before its next request
+        self.block[REQUEST_RELOAD] = 1
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def stats(self):
+        # deadline misses, rejected answers and latency percentiles in seconds
+        recorded = min(self.calls, len(self.latency))
+        latency = self.latency[:recorded]
+        latency = latency[~np.isnan(latency)]
+        compute_time = self.compute_time[:recorded]
+        compute_time = compute_time[~np.isnan(compute_time)]
+        stats = {
+            "calls": self.calls,
+            "misses": self.misses,
+            "invalid": self.invalid,
+            "errors": self.errors,
+        }
+        for name, values in (("latency", latency), ("compute_time", compute_time)):
+            if len(values):
+                p50, p99 = np.percentile(values, [50, 99])
+                stats[name] = {
+                    "p50": float(p50),
+                    "p99": float(p99),
+                    "max": float(values.max()),
+                }
+        return stats
+
+    def close(self):
+        if self.process.is_alive():
+            self.block[REQUEST_STOP] = 1
+            self.request.set()
+            self.process.join(1.0)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        del self.block, self.compute_time
+        self.shm.close()
+        self.shm.unlink()
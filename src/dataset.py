@@ -0,0 +1,329 @@
+# expert demonstration dataset for learned controllers
+#
+# runs BatchPID (the vectorized controller.controller) on BatchDrone with
+# randomised airframes, initial states, targets, steady wind and Dryden
+# turbulence, and writes every transition to fixed size .npy shards with a
+# JSON manifest. Shards are generated independently in a process pool, each
+# from its own SeedSequence child, so the data does not depend on the number
+# of workers. A shard is written through a memory map one step at a time, so
+# memory use is bounded by the batch size and not the dataset size.
+#
+# every worker keeps n_envs drones flying; an episode ends when the drone
+# touches the arena edges (terminal) or after episode_steps (timeout), and
+# that slot starts a new episode with a fresh airframe, state, target and wind.
+#
+#   python -m src.dataset data/ --transitions 100000000 --workers 8
+import argparse
+import json
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from .batch_drone import BatchDrone, GRAVITY
+from .batch_sim import BatchPID, box_bounds
+from .wind import DrydenTurbulence
+
+TRANSITION_DTYPE = np.dtype(
+    [
+        ("episode", "<u8"),
+        ("step", "<u4"),
+        ("state", "<f4", (6,)),
+        ("target", "<f4", (2,)),
+        ("action", "<f4", (2,)),
+        ("next_state", "<f4", (6,)),
+        ("wind", "<f4", (2,)),
+        # mass, rotational inertia, drag coefficient, reference area, rotor
+        # time constant
+        ("airframe", "<f4", (5,)),
+        ("terminal", "?"),
+        ("timeout", "?"),
+    ]
+)
+
+# the ranges of Environment.setup_drone_parameters
+AIRFRAME_RANGES = ((0.5, 1.3), (0.25, 0.5), (0.25, 0.75), (0.05, 0.15), (0.05, 0.1))
+THRUST_COEFFICIENT = 0.0000001984
+ROTOR_CONSTANT = 6432
+OMEGA_B = 1779
+
+DEFAULT_CONFIG = {
+    "dt": 1.0 / 60,
+    "n_envs": 1024,
+    "episode_steps": 600,
+    "arena": (0.0, 8.0),
+    "spawn_margin": 1.0,
+    "max_steady_wind": 5.0,
+    "turbulence_intensity": 0.5,
+    "turbulence_length": (50.0, 10.0),
+}
+
+
+class ExpertRollout:
+    # n_envs drones flown by the expert, reset one slot at a time
+    def __init__(self, seed_sequence, config):
+        self.config = config
+        self.rng = np.random.default_rng(seed_sequence)
+        n = config["n_envs"]
+        self.n = n
+        self.drones = BatchDrone(
+            n, 1, 1, 1, 1, THRUST_COEFFICIENT, 1, ROTOR_CONSTANT, OMEGA_B
+        )
+        self.expert = BatchPID(n)
+        self.turbulence = DrydenTurbulence(
+            config["turbulence_intensity"],
+            config["turbulence_length"],
+            dt=config["dt"],
+            n=n,
+            seed=self.rng.integers(2**63),
+        )
+        self.targets = np.empty((n, 2))
+        self.steady_wind = np.empty((n, 2))
+        self.airframe = np.empty((n, 5), dtype=np.float32)
+        self.episode = np.zeros(n, dtype=np.uint64)
+        self.step_count = np.zeros(n, dtype=np.uint32)
+        self.next_episode = 0
+        self.reset(np.arange(n))
+
+    def reset(self, slots):
+        # new episode in the given slots
+        rng = self.rng
+        k = len(slots)
+        drones = self.drones
+        airframe = np.stack(
+            [rng.uniform(low, high, k) for low, high in AIRFRAME_RANGES], axis=1
+        )
+        drones.mass[slots] = airframe[:, 0]
+        drones.rotational_inertia[slots] = airframe[:, 1]
+        drones.drag_coefficient[slots] = airframe[:, 2]
+        drones.reference_area[slots] = airframe[:, 3]
+        drones.rotor_time_constant[slots] = airframe[:, 4]
+        self.airframe[slots] = airframe
+
+        low, high = self.config["arena"]
+        margin = self.config["spawn_margin"]
+        drones.position[slots] = rng.uniform(low + margin, high - margin, (k, 2))
+        drones.velocity[slots] = rng.normal(0, 0.5, (k, 2))
+        drones.attitude[slots] = rng.uniform(-0.2, 0.2, k)
+        drones.angular_velocity[slots] = rng.normal(0, 0.5, k)
+        # start mid air with the rotors at hover speed
+        hover = np.sqrt(airframe[:, 0] * GRAVITY / (2 * THRUST_COEFFICIENT))
+        drones.rotor_speed[slots] = hover[:, None]
+        drones.last_action[slots] = 0
+        self.targets[slots] = rng.uniform(low + margin, high - margin, (k, 2))
+
+        # steady wind drawn like Wind.calc_init_wind
+        max_wind = self.config["max_steady_wind"]
+        angle = rng.uniform(0.25 * np.pi, 0.75 * np.pi, k) * rng.choice([-1, 1], k)
+        self.steady_wind[slots, 0] = rng.uniform(0, max_wind, k) * np.sin(angle)
+        self.steady_wind[slots, 1] = rng.uniform(0, max_wind, k) * np.cos(angle)
+
+        self.expert.e_int_x[slots] = 0
+        self.expert.e_int_y[slots] = 0
+        self.expert.e_int_phi[slots] = 0
+        self.episode[slots] = self.next_episode + np.arange(k, dtype=np.uint64)
+        self.next_episode += k
+        self.step_count[slots] = 0
+
+    def step(self, out):
+        """Advance every slot by one step and fill `out` with the transitions.
+
+        Args:
+            out (np.ndarray): (n_envs,) TRANSITION_DTYPE records to write to
+        """
+        dt = self.config["dt"]
+        state = self.drones.get_state()
+        actions, _ = self.expert(state, self.targets, dt)
+        wind = self.steady_wind + self.turbulence.sample()
+        self.drones.step(actions, dt, wind)
+        next_state = self.drones.get_state()
+        self.step_count += 1
+
+        low, high = self.config["arena"]
+        min_x, max_x, min_y, max_y = box_bounds(self.drones)
+        terminal = (min_x <= low) | (max_x >= high) | (min_y <= low) | (max_y >= high)
+        terminal |= ~np.isfinite(next_state).all(axis=1)
+        timeout = ~terminal & (self.step_count >= self.config["episode_steps"])
+
+        out["episode"] = self.episode
+        out["step"] = self.step_count - 1
+        out["state"] = state
+        out["target"] = self.targets
+        out["action"] = actions
+        out["next_state"] = next_state
+        out["wind"] = wind
+        out["airframe"] = self.airframe
+        out["terminal"] = terminal
+        out["timeout"] = timeout
+
+        done = np.flatnonzero(terminal | timeout)
+        if len(done):
+            self.reset(done)
+
+
+def write_shard(path, shard_index, size, seed_sequence, config):
+    """Generate one shard of `size` transitions into `path`.
+
+    The shard is written under a temporary name and renamed when complete,
+    so an interrupted run leaves no partial shards behind.
+
+    Returns:
+        dict: manifest entry of the shard
+    """
+    config = {**DEFAULT_CONFIG, **config}
+    n = config["n_envs"]
+    rollout = ExpertRollout(seed_sequence, config)
+    # episode ids are unique across shards
+    rollout.episode += np.uint64(shard_index) << np.uint64(32)
+    rollout.next_episode = (shard_index << 32) + n
+
+    temporary = str(path) + ".partial"
+    data = np.lib.format.open_memmap(
+        temporary, mode="w+", dtype=TRANSITION_DTYPE, shape=(size,)
+    )
+    block = np.empty(n, dtype=TRANSITION_DTYPE)
+    for start in range(0, size, n):
+        rollout.step(block)
+        stop = min(start + n, size)
+        data[start:stop] = block[: stop - start]
+    episodes = len(np.unique(data["episode"]))
+    data.flush()
+    del data
+    os.replace(temporary, path)
+    return {
+        "file": pathlib.Path(path).name,
+        "transitions": size,
+        "episodes": episodes,
+        "shard": shard_index,
+    }
+
+
+def write_manifest(directory, manifest):
+    # written under a temporary name and renamed, like the shards
+    temporary = directory / "manifest.json.partial"
+    with open(temporary, "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temporary, directory / "manifest.json")
+
+
+def generate(
+    directory,
+    transitions,
+    shard_size=2**20,
+    workers=None,
+    seed=0,
+    **config,
+):
+    """Write `transitions` expert transitions to shards in `directory`.
+
+    The manifest is written before the first shard and updated as shards
+    complete. An interrupted job can be restarted with the same arguments:
+    the shards listed in the manifest are kept and the others regenerated.
+
+    Args:
+        directory (str): output directory, created if needed
+        transitions (int): total number of transitions
+        shard_size (int, optional): transitions per shard, the last one may
+            be smaller
+        workers (int, optional): worker processes, defaults to the CPU count
+        seed (int, optional): root of the SeedSequence, one child per shard
+        **config: overrides of DEFAULT_CONFIG
+
+    Returns:
+        dict: the manifest, also written to directory/manifest.json
+
+    Raises:
+        ValueError: if the directory holds a dataset made with another seed,
+            shard size or config, or shards without a manifest
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    config = {**DEFAULT_CONFIG, **config}
+    n_shards = -(-transitions // shard_size)
+    children = np.random.SeedSequence(seed).spawn(n_shards)
+    manifest = {
+        "dtype": TRANSITION_DTYPE.descr,
+        "transitions": transitions,
+        "shard_size": shard_size,
+        "seed": seed,
+        "config": config,
+        "shards": [],
+    }
+    # the fields that determine the contents of every shard, as read back
+    # from JSON so tuples compare equal to lists
+    identity = ("dtype", "shard_size", "seed", "config")
+    expected = json.loads(json.dumps({key: manifest[key] for key in identity}))
+
+    previous = {}
+    manifest_path = directory / "manifest.json"
+    if manifest_path.exists():
+        with open(manifest_path) as file:
+            existing = json.load(file)
+        different = [key for key in identity if existing.get(key) != expected[key]]
+        if different:
+            raise ValueError(
+                f"{directory} holds a dataset with a different "
+                f"{', '.join(different)}, use another directory"
+            )
+        previous = {entry["shard"]: entry for entry in existing["shards"]}
+    elif any(directory.glob("shard_*.npy")):
+        raise ValueError(f"{directory} holds shards but no manifest.json")
+
+    entries = {}
+    jobs = []
+    for i, child in enumerate(children):
+        size = min(shard_size, transitions - i * shard_size)
+        path = directory / f"shard_{i:05d}.npy"
+        entry = previous.get(i)
+        if entry is not None and entry["transitions"] == size and path.exists():
+            entries[i] = entry
+            continue
+        jobs.append((path, i, size, child, config))
+
+    def shard_list():
+        return [entries[i] for i in sorted(entries)]
+
+    manifest["shards"] = shard_list()
+    write_manifest(directory, manifest)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(write_shard, *job) for job in jobs]
+        for future in as_completed(futures):
+            entry = future.result()
+            entries[entry["shard"]] = entry
+            manifest["shards"] = shard_list()
+            write_manifest(directory, manifest)
+    return manifest
+
+
+def load_shards(directory):
+    # memory mapped shards listed in the manifest, in order
+    directory = pathlib.Path(directory)
+    with open(directory / "manifest.json") as file:
+        manifest = json.load(file)
+    return [
+        np.load(directory / shard["file"], mmap_mode="r")
+        for shard in manifest["shards"]
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="expert demonstration dataset")
+    parser.add_argument("directory")
+    parser.add_argument("--transitions", type=int, default=10_000_000)
+    parser.add_argument("--shard-size", type=int, default=2**20)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-envs", type=int, default=DEFAULT_CONFIG["n_envs"])
+    parser.add_argument(
+        "--turbulence", type=float, default=DEFAULT_CONFIG["turbulence_intensity"]
+    )
+    args = parser.parse_args()
+    manifest = generate(
+        args.directory,
+        args.transitions,
+        shard_size=args.shard_size,
+        workers=args.workers,
+        seed=args.seed,
+        n_envs=args.n_envs,
+        turbulence_intensity=args.turbulence,
+    )
+    print(len(manifest["shards"]), "shards written to", args.directory)
@@ -157,6 +157,32 @@ class Drone:
             self.angular_velocity,
         )
 
+    def snapshot(self):
+        # every value that changes during step(), as a flat tuple of floats
+        return (
+            self.position_m.x,
+            self.position_m.y,
+            self.velocity.x,
+            self.velocity.y,
+            self.attitude,
+            self.angular_velocity,
+            *self.left_rotor.snapshot(),
+            *self.right_rotor.snapshot(),
+            *self.last_action,
+        )
+
+    def restore(self, values):
+        # inverse of snapshot()
+        self.position_m = math.Vector2(values[0], values[1])
+        self.position_px = self.position_m * 100
+        self.velocity = math.Vector2(values[2], values[3])
+        self.attitude = values[4]
+        self.angular_velocity = values[5]
+        self.left_rotor.restore(values[6:9])
+        self.right_rotor.restore(values[9:12])
+        self.last_action = [values[12], values[13]]
+        self.update_box()
+
     def reset(
         self,
         position_m: math.Vector2,
@@ -220,6 +246,12 @@ class Rotor:
     def get_thrust(self):
         return self.thrust
 
+    def snapshot(self):
+        return (self.desired_speed, self.speed, self.thrust)
+
+    def restore(self, values):
+        self.desired_speed, self.speed, self.thrust = values
+
     def reset(self):
         self.desired_speed = 0
         self.speed = 0
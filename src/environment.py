@@ -5,9 +5,19 @@ import pygame.freetype
 from pygame.math import Vector2
 from .drone import Drone
 from .wind import Wind
+from .flight_log import FlightRecorder
+from .latency import DelayLine
 from typing import Optional
 import pathlib
 from . import helpers
+import copy
+
+# layout of Environment.snapshot(): drone, wind vector, wind switch and step
+# counter, state of the wind's random generator, then the variable length wind
+# model state followed by the sensor and actuator delay lines, if any
+DRONE_SNAPSHOT_SIZE = 14
+RNG_STATE_SIZE = 625
+SNAPSHOT_FIXED_SIZE = DRONE_SNAPSHOT_SIZE + 4 + RNG_STATE_SIZE + 2
 
 
 class Environment:
@@ -26,6 +36,14 @@ class Environment:
         ui_width=0,
         rand_dynamics_seed=None,
         wind_active=False,
+        turbulence_intensity=0,
+        wind_field=None,
+        wind_seed=None,
+        sensor_delay=0.0,
+        sensor_jitter=0.0,
+        actuator_delay=0.0,
+        actuator_jitter=0.0,
+        latency_seed=None,
     ):
         self.screen_width = screen_width
         self.screen_height = screen_height
@@ -38,10 +56,34 @@ class Environment:
 
         # Generate wind vector
         self.wind_vector = Vector2(0, 0)
-        self.wind = Wind(5, 1, 0.1)
+        # wind_seed seeds the wind's own generators, None draws fresh entropy
+        self.wind = Wind(5, 1, 0.1, turbulence_intensity, seed=wind_seed)
+        # Optional wind_field.WindField, replaces the wind model when given
+        self.wind_field = wind_field
+        self.steps = 0
 
         # Generate drone
-        self.drone = Drone(*self.setup_drone_parameters(rand_dynamics_seed))
+        self.rand_dynamics_seed = rand_dynamics_seed
+        self.drone_parameters = self.setup_drone_parameters(rand_dynamics_seed)
+        self.drone = Drone(*self.drone_parameters)
+
+        # Optional latency, in seconds: observe() returns the state
+        # sensor_delay old and step() applies the action actuator_delay late
+        sensor_seed, actuator_seed = np.random.SeedSequence(latency_seed).spawn(2)
+        self.sensor_line = None
+        if sensor_delay or sensor_jitter:
+            self.sensor_line = DelayLine(
+                6, sensor_delay, sensor_jitter, seed=sensor_seed
+            )
+            self.sensor_line.reset(self.drone.get_state())
+        self.actuator_line = None
+        if actuator_delay or actuator_jitter:
+            self.actuator_line = DelayLine(
+                2, actuator_delay, actuator_jitter, seed=actuator_seed
+            )
+
+        # Optional flight log, see start_recording()
+        self.recorder = None
 
         if self.render_mode == "human" or self.render_mode == "rgb_array":
             self.init_pygame()
@@ -59,12 +101,39 @@ class Environment:
             ).convert_alpha()
         )
 
+    def observe(self):
+        """State seen by the controller, has no side effects.
+
+        Returns:
+            tuple: Drone.get_state(), delayed by the sensor latency if any
+        """
+        if self.sensor_line is None:
+            return self.drone.get_state()
+        return tuple(self.sensor_line.read().tolist())
+
     def step(self, action):
-        if self.wind_active:
-            self.wind_vector = self.wind.get_wind(1.0 / 60)
+        if self.actuator_line is not None:
+            action = tuple(self.actuator_line.step(action[:2]).tolist())
+        if self.wind_active and self.wind_field is not None:
+            position = (self.drone.position_m.x, self.drone.position_m.y)
+            wind = self.wind_field.sample(self.steps / 60, position)
+            wind_vector = Vector2(float(wind[0]), float(wind[1]))
+        elif self.wind_active:
+            wind_vector = self.wind.get_wind(1.0 / 60)
         else:
-            self.wind_vector = Vector2(0, 0)
+            wind_vector = Vector2(0, 0)
+
+        self.advance(action, wind_vector)
+        self.steps += 1
+        if self.sensor_line is not None:
+            self.sensor_line.push(self.drone.get_state())
 
+    def advance(self, action, wind_vector):
+        # physics step with a given wind vector, also used to replay flight logs
+        if self.recorder is not None:
+            self.recorder.record(self.drone, action, wind_vector)
+
+        self.wind_vector = wind_vector
         self.drone.step(action, 1.0 / 60, self.wind_vector)
 
         if self.render_mode == "human" or self.render_mode == "rgb_array":
@@ -157,17 +226,19 @@ class Environment:
     def toggle_wind(self):
         self.wind_active = not self.wind_active
 
-    def setup_drone_parameters(self, rand_dynamics_seed):
-        # set up the drone with random values seeded from group number
+    @staticmethod
+    def setup_drone_parameters(rand_dynamics_seed):
+        # set up the drone with random values seeded from group number, from a
+        # generator of its own so the global random state is left alone
 
-        random.seed(rand_dynamics_seed)
-        mass = random.uniform(0.5, 1.3)
+        rng = random.Random(rand_dynamics_seed)
+        mass = rng.uniform(0.5, 1.3)
         # Note that the worst case thrust to weight is just over 2
-        rotational_inertia = random.uniform(0.25, 0.5)
-        drag_coefficient = random.uniform(0.25, 0.75)
-        reference_area = random.uniform(0.05, 0.15)
+        rotational_inertia = rng.uniform(0.25, 0.5)
+        drag_coefficient = rng.uniform(0.25, 0.75)
+        reference_area = rng.uniform(0.05, 0.15)
         thrust_coefficient = 0.0000001984
-        rotor_time_constant = random.uniform(0.05, 0.1)
+        rotor_time_constant = rng.uniform(0.05, 0.1)
         rotor_constant = 6432
         omega_b = 1779
 
@@ -186,17 +257,142 @@ class Environment:
             omega_b,
         )
 
-    def reset(self, rand_dynamics_seed=None, wind_active=False):
-        self.drone.reset(*self.setup_drone_parameters(rand_dynamics_seed))
+    def start_recording(self, path, snapshot_interval=600):
+        # log every step to a binary file that replay.Replayer can seek in
+        self.stop_recording()
+        self.recorder = FlightRecorder(
+            path,
+            self.rand_dynamics_seed,
+            self.drone_parameters,
+            1.0 / 60,
+            snapshot_interval,
+        )
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def snapshot(self):
+        """Capture the dynamic state of the simulation in a flat float64 buffer.
+
+        The buffer holds the drone and rotor states, the wind model state,
+        the state of the wind's own random generator and the latency delay
+        lines, but none of the pygame objects, so it is cheap to take and to
+        restore.
+        """
+        rng_version, rng_internal, gauss_next = self.wind.rng.getstate()
+        variable = self.wind.snapshot()
+        for line in (self.sensor_line, self.actuator_line):
+            if line is not None:
+                variable.extend(line.snapshot())
+        buffer = np.empty(SNAPSHOT_FIXED_SIZE + len(variable))
+        buffer[:DRONE_SNAPSHOT_SIZE] = self.drone.snapshot()
+        i = DRONE_SNAPSHOT_SIZE
+        buffer[i : i + 4] = (
+            self.wind_vector.x,
+            self.wind_vector.y,
+            self.wind_active,
+            self.steps,
+        )
+        i += 4
+        buffer[i : i + RNG_STATE_SIZE] = np.fromiter(
+            rng_internal, dtype=np.int64, count=RNG_STATE_SIZE
+        )
+        i += RNG_STATE_SIZE
+        buffer[i : i + 2] = (gauss_next is not None, gauss_next or 0)
+        buffer[SNAPSHOT_FIXED_SIZE:] = variable
+        return buffer
+
+    def restore(self, buffer):
+        # inverse of snapshot(), the wind gets a new generator so that clones
+        # never share one
+        values = buffer[: DRONE_SNAPSHOT_SIZE + 4].tolist()
+        self.drone.restore(values[:DRONE_SNAPSHOT_SIZE])
+        i = DRONE_SNAPSHOT_SIZE
+        self.wind_vector = Vector2(values[i], values[i + 1])
+        self.wind_active = bool(values[i + 2])
+        self.steps = int(values[i + 3])
+        i += 4
+        rng_internal = tuple(buffer[i : i + RNG_STATE_SIZE].astype(np.int64).tolist())
+        i += RNG_STATE_SIZE
+        gauss_next = buffer[i + 1].item() if buffer[i] else None
+        self.wind.rng = random.Random()
+        self.wind.rng.setstate((3, rng_internal, gauss_next))
+        values = buffer[SNAPSHOT_FIXED_SIZE:].tolist()
+        i = self.wind.restore(values)
+        for line in (self.sensor_line, self.actuator_line):
+            if line is not None:
+                i += line.restore(values[i:])
+
+    def clone(self, count=1, snapshot=None):
+        """Make headless copies of the environment.
+
+        Args:
+            count (int, optional): number of copies. Defaults to 1.
+            snapshot (np.ndarray, optional): state to start the copies from.
+                Defaults to the current state.
+
+        Returns:
+            list: `count` Environments without rendering, each restored from
+            the snapshot. Every copy has its own random generators, so copies
+            can be stepped in any interleaving and stay deterministic.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        clones = []
+        for _ in range(count):
+            env = Environment.__new__(Environment)
+            env.screen_width = self.screen_width
+            env.screen_height = self.screen_height
+            env.ui_width = self.ui_width
+            env.last_frame_time = 0
+            env.render_mode = None
+            env.render_path = False
+            env.wind_active = self.wind_active
+            env.wind_vector = Vector2(0, 0)
+            env.wind = copy.copy(self.wind)
+            if hasattr(self.wind, "turbulence"):
+                env.wind.turbulence = self.wind.turbulence.copy()
+            env.wind_field = self.wind_field
+            env.rand_dynamics_seed = self.rand_dynamics_seed
+            env.drone_parameters = self.drone_parameters
+            env.drone = Drone(*self.drone_parameters)
+            env.drone.width_px = self.drone.width_px
+            env.drone.height_px = self.drone.height_px
+            env.sensor_line = copy.deepcopy(self.sensor_line)
+            env.actuator_line = copy.deepcopy(self.actuator_line)
+            env.recorder = None
+            env.restore(snapshot)
+            clones.append(env)
+        return clones
+
+    def reset(self, rand_dynamics_seed=None, wind_active=False, wind_seed=None):
+        # a log only covers one airframe, so resetting ends the recording
+        self.stop_recording()
+        self.rand_dynamics_seed = rand_dynamics_seed
+        self.drone_parameters = self.setup_drone_parameters(rand_dynamics_seed)
+        self.drone.reset(*self.drone_parameters)
+        if self.sensor_line is not None:
+            self.sensor_line.reset(self.drone.get_state())
+        if self.actuator_line is not None:
+            self.actuator_line.reset()
         self.wind_active = wind_active
         self.wind_vector = Vector2(0, 0)
+        self.steps = 0
         self.wind = Wind(
-            self.wind.max_steady_state, self.wind.max_gust, self.wind.k_gusts
+            self.wind.max_steady_state,
+            self.wind.max_gust,
+            self.wind.k_gusts,
+            self.wind.turbulence_intensity,
+            self.wind.turbulence_length,
+            seed=wind_seed,
         )
         if self.render_mode == "human" or self.render_mode == "rgb_array":
             self.flight_path = []
 
     def close(self):
+        self.stop_recording()
         pygame.quit()
 
     def add_postion_to_flight_path(self, position):
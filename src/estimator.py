@@ -0,0 +1,544 @@
+# batched state estimators for the drone
+#
+# both filters track N drones at once with preallocated state and
+# covariance arrays:
+#   KalmanFilter          -> linear constant velocity model on the
+#                            get_state() vector [x, y, vx, vy, phi, phidot]
+#   ExtendedKalmanFilter  -> the Drone/Rotor dynamics from drone.py, with
+#                            the two rotor speeds appended to the state
+#
+# measurements come from sensors.SensorModel. Only the channels that
+# produced a sample are fused, which handles dropouts per drone.
+#
+# the x, y and phi axes of the constant velocity model are independent, so
+# the KalmanFilter keeps one 2x2 (position, velocity) covariance block per
+# axis and updates the blocks in closed form. The ExtendedKalmanFilter has a
+# full covariance and fuses each two component channel as one 2x2 update.
+# Neither filter allocates per drone arrays once the time step is set.
+import numpy as np
+from .sensors import STATE_SIZE, CHANNEL_INDICES
+
+PHI = 4
+
+
+def wrap_angle(angle, out=None):
+    out = np.add(angle, np.pi, out=out)
+    np.mod(out, 2 * np.pi, out=out)
+    out -= np.pi
+    return out
+
+
+class _BatchFilter:
+    def __init__(self, n, dim, measurement_variance):
+        self.n = n
+        self.dim = dim
+        self.measurement_variance = np.broadcast_to(
+            np.asarray(measurement_variance, dtype=float), (STATE_SIZE,)
+        ).copy()
+        self.x = np.zeros((n, dim))
+
+    def initialize(self, states, variance=1.0):
+        """Set the estimate of every drone.
+
+        Args:
+            states (np.ndarray): (N, 6) states in get_state() order
+            variance (float | np.ndarray): initial variance per state component
+        """
+        self.x[:] = 0
+        self.x[:, :STATE_SIZE] = states
+        self._initialize_covariance(
+            np.broadcast_to(np.asarray(variance, dtype=float), (self.dim,))
+        )
+
+    def get_state(self, i=0):
+        # estimate of one drone as a get_state() style tuple
+        return tuple(self.x[i, :STATE_SIZE])
+
+
+# covariance block rows and the position and velocity columns of the axes
+# measured by each update, in the order of the channels
+KF_UPDATES = (
+    # channel, block rows, position columns, velocity columns, measures velocity
+    (0, slice(0, 2), slice(0, 2), slice(2, 4), False),
+    (1, slice(0, 2), slice(0, 2), slice(2, 4), True),
+    (2, slice(2, 3), slice(4, 5), slice(5, 6), False),
+    (2, slice(2, 3), slice(4, 5), slice(5, 6), True),
+)
+POSITION_COLUMNS = [0, 1, 4]
+VELOCITY_COLUMNS = [2, 3, 5]
+
+
+class KalmanFilter(_BatchFilter):
+    def __init__(
+        self,
+        n=1,
+        measurement_variance=1e-4,
+        acceleration_std=2.0,
+        angular_acceleration_std=5.0,
+    ):
+        super().__init__(n, STATE_SIZE, measurement_variance)
+        self.acceleration_std = acceleration_std
+        self.angular_acceleration_std = angular_acceleration_std
+
+        # (3, N) covariance blocks of the x, y and phi axes
+        self.p_position = np.zeros((3, n))
+        self.p_cross = np.zeros((3, n))
+        self.p_velocity = np.zeros((3, n))
+        # per drone copies of the small operands, numpy buffers and
+        # allocates when a broadcast one is mixed with (3, N) blocks
+        self._variance = np.repeat(self.measurement_variance[:, None], n, axis=1)
+        self.q_position = np.empty((3, n))
+        self.q_cross = np.empty((3, n))
+        self.q_velocity = np.empty((3, n))
+        self._dt = None
+
+        # scratch buffers for predict/update
+        self._s = np.empty((3, n))
+        self._k_position = np.empty((3, n))
+        self._k_velocity = np.empty((3, n))
+        self._innovation = np.empty((3, n))
+        self._work = np.empty((3, n))
+        self._step = np.empty(n)
+        self._mask = np.empty(n)
+
+    def _initialize_covariance(self, variance):
+        self.p_position[:] = variance[POSITION_COLUMNS, None]
+        self.p_cross[:] = 0
+        self.p_velocity[:] = variance[VELOCITY_COLUMNS, None]
+
+    @property
+    def P(self):
+        # (N, 6, 6) covariance assembled from the blocks, for inspection
+        P = np.zeros((self.n, STATE_SIZE, STATE_SIZE))
+        for axis, (pos, vel) in enumerate(zip(POSITION_COLUMNS, VELOCITY_COLUMNS)):
+            P[:, pos, pos] = self.p_position[axis]
+            P[:, pos, vel] = P[:, vel, pos] = self.p_cross[axis]
+            P[:, vel, vel] = self.p_velocity[axis]
+        return P
+
+    def _build_model(self, dt):
+        # constant velocity on each axis, driven by white acceleration noise
+        variance = (
+            np.array(
+                [
+                    self.acceleration_std,
+                    self.acceleration_std,
+                    self.angular_acceleration_std,
+                ]
+            )[:, None]
+            ** 2
+        )
+        self.q_position[:] = variance * dt**4 / 4
+        self.q_cross[:] = variance * dt**3 / 2
+        self.q_velocity[:] = variance * dt**2
+        self._dt = dt
+
+    def predict(self, dt):
+        if dt != self._dt:
+            self._build_model(dt)
+        x = self.x
+        # one column at a time, numpy buffers strided (N, 2) operands
+        for pos, vel in zip(POSITION_COLUMNS, VELOCITY_COLUMNS):
+            np.multiply(x[:, vel], dt, out=self._step)
+            x[:, pos] += self._step
+        wrap_angle(x[:, 4], out=x[:, 4])
+
+        # [[1, dt], [0, 1]] P [[1, 0], [dt, 1]] + Q on every block
+        work = self._work
+        np.multiply(self.p_cross, 2 * dt, out=work)
+        self.p_position += work
+        np.multiply(self.p_velocity, dt * dt, out=work)
+        self.p_position += work
+        self.p_position += self.q_position
+        np.multiply(self.p_velocity, dt, out=work)
+        self.p_cross += work
+        self.p_cross += self.q_cross
+        self.p_velocity += self.q_velocity
+
+    def update(self, measurement, valid):
+        """Fuse a batch of measurements.
+
+        Args:
+            measurement (np.ndarray): (N, 6) measurements in get_state() order
+            valid (np.ndarray): (N, 3) mask of channels with a new sample
+        """
+        for channel, rows, position, velocity, measures_velocity in KF_UPDATES:
+            mask = valid[:, channel]
+            if not mask.any():
+                continue
+            self._block_update(
+                rows, position, velocity, measures_velocity, measurement, mask
+            )
+
+    def _block_update(
+        self, rows, position, velocity, measures_velocity, measurement, mask
+    ):
+        # scalar update of the position or the velocity of the axes in rows
+        k = rows.stop - rows.start
+        p = self.p_position[rows]
+        c = self.p_cross[rows]
+        v = self.p_velocity[rows]
+        s = self._s[:k]
+        k_position = self._k_position[:k]
+        k_velocity = self._k_velocity[:k]
+        innovation = self._innovation[:k]
+        work = self._work[:k]
+        measured = velocity if measures_velocity else position
+
+        # gain of the measured component, the other follows its covariance
+        if measures_velocity:
+            np.add(v, self._variance[measured], out=s)
+            np.divide(c, s, out=k_position)
+            np.divide(v, s, out=k_velocity)
+        else:
+            np.add(p, self._variance[measured], out=s)
+            np.divide(p, s, out=k_position)
+            np.divide(c, s, out=k_velocity)
+        if not mask.all():
+            np.copyto(self._mask, mask)
+            k_position *= self._mask
+            k_velocity *= self._mask
+
+        np.subtract(measurement[:, measured].T, self.x[:, measured].T, out=innovation)
+        if measured.start == PHI:
+            wrap_angle(innovation, out=innovation)
+        np.multiply(k_position, innovation, out=work)
+        self.x[:, position].T[:] += work
+        np.multiply(k_velocity, innovation, out=work)
+        self.x[:, velocity].T[:] += work
+
+        # P - K H P, each entry from the old values it depends on
+        if measures_velocity:
+            np.multiply(k_position, c, out=work)
+            p -= work
+            np.multiply(k_velocity, c, out=work)
+            c -= work
+            np.multiply(k_velocity, v, out=work)
+            v -= work
+        else:
+            np.multiply(k_velocity, c, out=work)
+            v -= work
+            np.multiply(k_position, c, out=work)
+            c -= work
+            np.multiply(k_position, p, out=work)
+            p -= work
+
+
+class ExtendedKalmanFilter(_BatchFilter):
+    # state: [x, y, vx, vy, phi, phidot, omega_left, omega_right]
+    def __init__(
+        self,
+        n=1,
+        measurement_variance=1e-4,
+        mass=1.0,
+        rotational_inertia=0.4,
+        drag_coefficient=0.5,
+        reference_area=0.1,
+        thrust_coefficient=0.0000001984,
+        rotor_time_constant=0.075,
+        rotor_constant=6432,
+        omega_b=1779,
+        acceleration_std=1.0,
+        angular_acceleration_std=2.0,
+        rotor_speed_std=50.0,
+        air_density=1.225,
+        arm_length=0.25,
+    ):
+        super().__init__(n, STATE_SIZE + 2, measurement_variance)
+
+        # airframe parameters, scalar or one value per drone
+        self.mass = np.broadcast_to(np.asarray(mass, dtype=float), (n,))
+        self.rotational_inertia = np.broadcast_to(
+            np.asarray(rotational_inertia, dtype=float), (n,)
+        )
+        self.drag_constant = np.broadcast_to(
+            0.5
+            * np.asarray(drag_coefficient, dtype=float)
+            * np.asarray(reference_area, dtype=float)
+            * air_density,
+            (n,),
+        )
+        self.thrust_coefficient = np.broadcast_to(
+            np.asarray(thrust_coefficient, dtype=float), (n,)
+        )
+        self.rotor_time_constant = np.broadcast_to(
+            np.asarray(rotor_time_constant, dtype=float), (n,)
+        )
+        self.rotor_constant = np.broadcast_to(
+            np.asarray(rotor_constant, dtype=float), (n,)
+        )
+        self.omega_b = np.broadcast_to(np.asarray(omega_b, dtype=float), (n,))
+        self.arm_length = arm_length
+
+        self.acceleration_std = acceleration_std
+        self.angular_acceleration_std = angular_acceleration_std
+        self.rotor_speed_std = rotor_speed_std
+
+        self.P = np.zeros((n, self.dim, self.dim))
+        self.Q = np.zeros((self.dim, self.dim))
+        # per drone copy, numpy buffers and allocates for a broadcast one
+        self._Q = np.empty((n, self.dim, self.dim))
+        self.F = np.zeros((n, self.dim, self.dim))
+        self._jacobian = np.zeros((self.dim, self.dim, n))
+        self._dt = None
+
+        # scratch buffers for predict/update
+        self._speed = np.empty((2, n))
+        self._thrust = np.empty((2, n))
+        self._slope = np.empty((2, n))
+        self._work = np.empty((8, n))
+        self._Ft = np.empty((n, self.dim, self.dim))
+        self._PFt = np.empty((n, self.dim, self.dim))
+        self._HP = np.empty((n, 2, self.dim))
+        self._S = np.empty((n, 2, 2))
+        self._K = np.empty((n, self.dim, 2))
+        self._gain = np.empty((3, n))
+        self._innovation = np.empty((n, 2, 1))
+        self._mask = np.empty(n)
+        self._correction = np.empty((n, self.dim, 1))
+        self._KP = np.empty((n, self.dim, self.dim))
+
+    @classmethod
+    def from_parameters(cls, parameters, n=1, **kwargs):
+        # build from the tuple returned by Environment.setup_drone_parameters
+        (
+            _,
+            _,
+            _,
+            _,
+            mass,
+            rotational_inertia,
+            drag_coefficient,
+            reference_area,
+            thrust_coefficient,
+            rotor_time_constant,
+            rotor_constant,
+            omega_b,
+        ) = parameters
+        return cls(
+            n,
+            mass=mass,
+            rotational_inertia=rotational_inertia,
+            drag_coefficient=drag_coefficient,
+            reference_area=reference_area,
+            thrust_coefficient=thrust_coefficient,
+            rotor_time_constant=rotor_time_constant,
+            rotor_constant=rotor_constant,
+            omega_b=omega_b,
+            **kwargs,
+        )
+
+    def initialize(self, states, variance=1.0, rotor_speed=None):
+        """Set the estimate of every drone.
+
+        Args:
+            states (np.ndarray): (N, 6) states in get_state() order
+            variance (float | np.ndarray): initial variance per state component
+            rotor_speed (float | np.ndarray, optional): rotor speeds, (N, 2) as
+                BatchDrone.rotor_speed, (N,) for both rotors of each drone or
+                one value for all. The rotors start at rest, as after
+                Rotor.reset, by default
+        """
+        super().initialize(states, variance)
+        if rotor_speed is None:
+            self.x[:, 6:] = 0
+            return
+        rotor_speed = np.asarray(rotor_speed, dtype=float)
+        if rotor_speed.ndim <= 1:
+            rotor_speed = rotor_speed[..., None]
+        self.x[:, 6:] = rotor_speed
+
+    def _initialize_covariance(self, variance):
+        self.P[:] = 0
+        self.P[:, range(self.dim), range(self.dim)] = variance
+
+    def _build_model(self, dt):
+        self.Q[:] = 0
+        for pos, vel, std in (
+            (0, 2, self.acceleration_std),
+            (1, 3, self.acceleration_std),
+            (4, 5, self.angular_acceleration_std),
+        ):
+            self.Q[pos, pos] = std**2 * dt**4 / 4
+            self.Q[pos, vel] = self.Q[vel, pos] = std**2 * dt**3 / 2
+            self.Q[vel, vel] = std**2 * dt**2
+        self.Q[6, 6] = self.Q[7, 7] = self.rotor_speed_std**2
+        self._Q[:] = self.Q
+
+        # per drone constants of the step and the entries of the Jacobian
+        # that do not depend on the state, the others are written by predict
+        self._rotor_gain = dt / self.rotor_time_constant
+        decay = 1 - self._rotor_gain
+        self._thrust_slope = 2 * self.thrust_coefficient * decay
+        self._step_over_mass = dt / self.mass
+        self._drag_gain = self.drag_constant * self._step_over_mass
+        self._torque_gain = self.arm_length / self.rotational_inertia * dt
+        J = self._jacobian
+        J[:] = 0
+        J[0, 0] = J[1, 1] = J[4, 4] = J[5, 5] = 1
+        J[4, 5] = dt
+        J[6, 6] = J[7, 7] = decay
+        self._dt = dt
+
+    def predict(self, actions, dt, wind=None):
+        """Propagate the estimates through one Drone.step.
+
+        Args:
+            actions (np.ndarray): (N, 2) motor commands applied this step
+            dt (float): time step
+            wind (np.ndarray, optional): (N, 2) or (2,) known wind vector
+        """
+        if dt != self._dt:
+            self._build_model(dt)
+
+        x = self.x
+        total, sin_phi, cos_phi, rx, ry, speed_rel, safe, work = self._work
+
+        # rotors, first order lag as in Rotor.step, one rotor per row as
+        # numpy buffers strided (N, 2) operands
+        speed = self._speed
+        for rotor in range(2):
+            np.clip(actions[:, rotor], 0, 1, out=speed[rotor])
+            speed[rotor] *= self.rotor_constant
+            speed[rotor] += self.omega_b
+            speed[rotor] -= x[:, 6 + rotor]
+            speed[rotor] *= self._rotor_gain
+            speed[rotor] += x[:, 6 + rotor]
+        thrust = np.multiply(speed, speed, out=self._thrust)
+        thrust *= self.thrust_coefficient
+        slope = np.multiply(speed, self._thrust_slope, out=self._slope)
+        np.add(thrust[0], thrust[1], out=total)
+
+        np.sin(x[:, 4], out=sin_phi)
+        np.cos(x[:, 4], out=cos_phi)
+
+        # quadratic drag on the air relative velocity
+        if wind is None:
+            rx[:] = x[:, 2]
+            ry[:] = x[:, 3]
+        else:
+            wind = np.asarray(wind)
+            np.subtract(x[:, 2], wind[..., 0], out=rx)
+            np.subtract(x[:, 3], wind[..., 1], out=ry)
+        np.hypot(rx, ry, out=speed_rel)
+        np.maximum(speed_rel, np.finfo(float).tiny, out=safe)
+
+        # Jacobian of the semi-implicit Euler step in Drone.step, velocity
+        # rows first: d(drag)/d(v) = -c (|r| I + r r^T / |r|). J holds it
+        # drone axis last, so every entry is written contiguously
+        J = self._jacobian
+        g = self._drag_gain
+        h = self._step_over_mass
+        np.multiply(rx, rx, out=work)
+        work /= safe
+        work += speed_rel
+        work *= g
+        np.subtract(1, work, out=J[2, 2])
+        np.multiply(ry, ry, out=work)
+        work /= safe
+        work += speed_rel
+        work *= g
+        np.subtract(1, work, out=J[3, 3])
+        np.multiply(rx, ry, out=work)
+        work /= safe
+        work *= g
+        np.negative(work, out=J[2, 3])
+        J[3, 2] = J[2, 3]
+        np.multiply(total, cos_phi, out=work)
+        np.multiply(work, h, out=J[2, 4])
+        np.multiply(total, sin_phi, out=work)
+        np.multiply(work, h, out=J[3, 4])
+        np.multiply(sin_phi, h, out=work)
+        np.multiply(slope, work, out=J[2, 6:])
+        np.multiply(cos_phi, h, out=work)
+        np.negative(work, out=work)
+        np.multiply(slope, work, out=J[3, 6:])
+        # angular rate row
+        np.multiply(slope[0], self._torque_gain, out=J[5, 6])
+        np.multiply(slope[1], self._torque_gain, out=J[5, 7])
+        np.negative(J[5, 7], out=J[5, 7])
+        # position and attitude use the updated rates
+        np.multiply(J[2, 2:], dt, out=J[0, 2:])
+        np.multiply(J[3, 2:], dt, out=J[1, 2:])
+        np.multiply(J[5, 6:], dt, out=J[4, 6:])
+
+        # state propagation, drag = -c |r| r
+        speed_rel *= self.drag_constant
+        np.multiply(total, sin_phi, out=work)
+        np.multiply(speed_rel, rx, out=rx)
+        work -= rx
+        work *= h
+        x[:, 2] += work
+        np.multiply(total, cos_phi, out=work)
+        np.multiply(speed_rel, ry, out=ry)
+        work += ry
+        work *= h
+        x[:, 3] -= work
+        x[:, 3] += 9.81 * dt
+        np.multiply(x[:, 2], dt, out=work)
+        x[:, 0] += work
+        np.multiply(x[:, 3], dt, out=work)
+        x[:, 1] += work
+        np.subtract(thrust[0], thrust[1], out=work)
+        work *= self._torque_gain
+        x[:, 5] += work
+        np.multiply(x[:, 5], dt, out=work)
+        x[:, 4] += work
+        wrap_angle(x[:, 4], out=x[:, 4])
+        x[:, 6] = speed[0]
+        x[:, 7] = speed[1]
+
+        # P = F P F^T + Q, with contiguous copies of F and F^T as matmul
+        # is much slower on strided operands
+        np.copyto(self.F, J.transpose(2, 0, 1))
+        np.copyto(self._Ft, np.swapaxes(self.F, 1, 2))
+        np.matmul(self.P, self._Ft, out=self._PFt)
+        np.matmul(self.F, self._PFt, out=self.P)
+        self.P += self._Q
+
+    def update(self, measurement, valid):
+        """Fuse a batch of measurements, one 2x2 update per channel.
+
+        Args:
+            measurement (np.ndarray): (N, 6) measurements in get_state() order
+            valid (np.ndarray): (N, 3) mask of channels with a new sample
+        """
+        for channel, (i, j) in enumerate(CHANNEL_INDICES):
+            mask = valid[:, channel]
+            if mask.any():
+                self._channel_update(i, j, measurement, mask)
+
+    def _channel_update(self, i, j, measurement, mask):
+        # K = P H^T S^-1 with S = H P H^T + R, then P -= K H P. H P is the
+        # two rows of P of the channel, P H^T its transpose as P is symmetric
+        HP = self._HP
+        HP[:] = self.P[:, i : j + 1]
+        a, b, d = self._gain
+        np.add(HP[:, 0, i], self.measurement_variance[i], out=a)
+        b[:] = HP[:, 0, j]
+        np.add(HP[:, 1, j], self.measurement_variance[j], out=d)
+        # S^-1 = [[d, -b], [-b, a]] / det, zero for drones without a sample
+        determinant = self._work[0]
+        np.multiply(a, d, out=determinant)
+        np.multiply(b, b, out=self._work[1])
+        determinant -= self._work[1]
+        np.copyto(self._mask, mask)
+        np.divide(self._mask, determinant, out=determinant)
+        S = self._S
+        np.multiply(d, determinant, out=S[:, 0, 0])
+        np.multiply(a, determinant, out=S[:, 1, 1])
+        np.multiply(b, determinant, out=S[:, 0, 1])
+        np.negative(S[:, 0, 1], out=S[:, 0, 1])
+        S[:, 1, 0] = S[:, 0, 1]
+        K = np.matmul(np.swapaxes(HP, 1, 2), S, out=self._K)
+
+        innovation = self._innovation
+        for row, k in enumerate((i, j)):
+            np.subtract(measurement[:, k], self.x[:, k], out=innovation[:, row, 0])
+        if i == PHI:
+            wrap_angle(innovation[:, 0, 0], out=innovation[:, 0, 0])
+        np.matmul(K, innovation, out=self._correction)
+        self.x += self._correction[:, :, 0]
+
+        np.matmul(K, HP, out=self._KP)
+        self.P -= self._KP
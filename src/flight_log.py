@@ -0,0 +1,109 @@
+# compact binary flight logs
+#
+# layout (little endian, all floats are float64 so replays are bit exact):
+#   header    -> magic, seed, dt, the 8 airframe parameters, snapshot
+#                interval K and the snapshot length S
+#   block 0   -> snapshot (S floats) + up to K step records
+#   block 1   -> snapshot (S floats) + up to K step records
+#   ...
+# a step record is (u1, u2, wind_x, wind_y), i.e. the action passed to
+# Drone.step and the wind vector it was stepped with. The snapshot at the
+# start of block j is the Drone.snapshot() taken before step j * K, so the
+# log can be entered at any block without simulating the ones before it.
+import struct
+import numpy as np
+
+MAGIC = b"DRNLOG01"
+HEADER = struct.Struct("<8sqd8dII")
+STEP_SIZE = 4
+NO_SEED = -1
+
+
+class FlightRecorder:
+    def __init__(self, path, seed, drone_parameters, dt, snapshot_interval=600):
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.steps = 0
+        self.snapshot_size = None
+
+        self.seed = seed if isinstance(seed, int) and seed >= 0 else NO_SEED
+        self.dt = dt
+        # mass, inertia, drag coefficient, area, thrust coefficient,
+        # rotor time constant, rotor constant, omega_b
+        self.airframe = tuple(float(p) for p in drone_parameters[4:])
+
+        self.file = open(path, "wb")
+
+    def record(self, drone, action, wind_vector):
+        # called before the drone is stepped with this action and wind
+        if self.steps % self.snapshot_interval == 0:
+            snapshot = drone.snapshot()
+            if self.snapshot_size is None:
+                self.snapshot_size = len(snapshot)
+                self.file.write(
+                    HEADER.pack(
+                        MAGIC,
+                        self.seed,
+                        self.dt,
+                        *self.airframe,
+                        self.snapshot_interval,
+                        self.snapshot_size,
+                    )
+                )
+            self.file.write(struct.pack(f"<{self.snapshot_size}d", *snapshot))
+
+        self.file.write(
+            struct.pack(
+                "<4d",
+                float(action[0]),
+                float(action[1]),
+                float(wind_vector[0]),
+                float(wind_vector[1]),
+            )
+        )
+        self.steps += 1
+
+    def close(self):
+        self.file.close()
+
+
+class FlightLog:
+    def __init__(self, path):
+        data = np.fromfile(path, dtype=np.uint8)
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path} is empty or not a flight log")
+
+        header = HEADER.unpack(data[: HEADER.size].tobytes())
+        if header[0] != MAGIC:
+            raise ValueError(f"{path} is not a flight log")
+
+        self.seed = None if header[1] == NO_SEED else header[1]
+        self.dt = header[2]
+        self.airframe = header[3:11]
+        self.snapshot_interval = header[11]
+        self.snapshot_size = header[12]
+
+        # view the body as float64 and split it into whole blocks
+        body = data[HEADER.size :]
+        body = body[: len(body) - len(body) % 8].view("<f8")
+        block = self.snapshot_size + self.snapshot_interval * STEP_SIZE
+        n_blocks = -(-len(body) // block)
+        padded = np.full(n_blocks * block, np.nan)
+        padded[: len(body)] = body
+        padded = padded.reshape(n_blocks, block)
+
+        self.snapshots = padded[:, : self.snapshot_size]
+        records = padded[:, self.snapshot_size :].reshape(-1, STEP_SIZE)
+
+        # drop the unwritten tail of the last block
+        tail = len(body) - (n_blocks - 1) * block - self.snapshot_size
+        self.n_steps = (n_blocks - 1) * self.snapshot_interval + max(
+            0, tail // STEP_SIZE
+        )
+        self.actions = records[: self.n_steps, :2]
+        self.wind = records[: self.n_steps, 2:]
+
+    def snapshot_before(self, step):
+        # (index of the step the snapshot was taken at, snapshot values)
+        block = min(step // self.snapshot_interval, len(self.snapshots) - 1)
+        return block * self.snapshot_interval, self.snapshots[block]
@@ -0,0 +1,306 @@
+# batched frequency response of the closed loop around hover
+#
+# a sinusoidal disturbance is injected into N copies of the same airframe
+# hovering at a target under BatchPID, one frequency (or one multi-sine subset
+# of the frequencies) per copy, and all copies run as a single BatchDrone. Every
+# frequency is snapped to a bin of the recording window, so after the settle
+# time the window holds a whole number of periods of every excited sine and the
+# responses are read off the FFT without leakage.
+#
+# the disturbance enters as an external force or torque, as wind, or added to
+# the thrust or moment command of the controller. The last two break the loop
+# at the controller output, which gives the loop gain and its stability margins:
+#
+#   plant input p = c + d, c = -L p  =>  L = -C / (C + D)
+#
+#   python -m src.frequency_response --input moment
+import argparse
+import numpy as np
+from .batch_drone import BatchDrone, GRAVITY
+from .batch_sim import BatchPID
+from .environment import Environment
+
+INPUTS = ("force_x", "force_y", "torque", "wind_x", "wind_y", "thrust", "moment")
+OUTPUTS = ("x", "y", "phi", "thrust", "moment")
+# inputs added to the controller output, for which the loop gain is defined
+COMMAND_INPUTS = ("thrust", "moment")
+
+
+def hover(drones, controller=None):
+    """Rotor speeds and, for a BatchPID, the altitude integrator at hover.
+
+    Returns:
+        np.ndarray: (N,) motor command that holds every drone in the air
+    """
+    speed = np.sqrt(drones.mass * GRAVITY / (2 * drones.thrust_coefficient))
+    drones.rotor_speed[:] = speed[:, None]
+    action = (speed - drones.omega_b) / drones.rotor_constant
+    if isinstance(controller, BatchPID):
+        # at rest on the target only the integral term produces thrust
+        controller.e_int_y[:] = np.clip(action / controller.ki_y, -0.15, 0.15)
+    return action
+
+
+def multisine_plan(frequencies, record_steps, dt, frequencies_per_run=1):
+    """Snap frequencies to FFT bins and share them out over the runs.
+
+    Frequencies that snap to the same bin are merged. Run j excites the bins
+    j, j + R, j + 2R, ... of the sorted list, so the tones of a run are spread
+    over the whole band, with Schroeder phases to keep the crest factor low.
+
+    Returns:
+        tuple: (bins (F,), run (F,) run of every bin, phase (F,))
+    """
+    window = record_steps * dt
+    bins = np.unique(np.rint(np.asarray(frequencies) * window).astype(int))
+    bins = bins[(bins >= 1) & (bins < record_steps // 2)]
+    runs = -(-len(bins) // frequencies_per_run)
+    run = np.arange(len(bins)) % runs
+    slot = np.arange(len(bins)) // runs
+    count = np.bincount(run)[run]
+    phase = -np.pi * slot * (slot + 1) / count
+    return bins, run, phase
+
+
+def frequency_response(
+    parameters=None,
+    frequencies=np.geomspace(0.1, 10, 30),
+    input="moment",
+    amplitude=0.02,
+    controller=None,
+    target=(4.0, 4.0),
+    dt=1.0 / 60,
+    settle_time=5.0,
+    periods=4,
+    frequencies_per_run=1,
+    arena=(0.0, 8.0),
+):
+    """Frequency response from a disturbance to the states and commands.
+
+    Args:
+        parameters (tuple, optional): Environment.setup_drone_parameters
+            output, the airframe of seed None by default
+        frequencies (np.ndarray, optional): frequencies in Hz, snapped to the
+            resolution of the recording window
+        input (str, optional): one of INPUTS; forces in N, torque in N m, wind
+            in m/s, thrust and moment in motor command units
+        amplitude (float, optional): amplitude of a single sine. A multi-sine
+            scales its tones by 1 / sqrt(K) to keep the same power
+        controller (BatchPID, optional): controller for len(frequencies) runs,
+            with the gains of controller.py by default. Only the runs that are
+            used are kept.
+        target (tuple, optional): hover position in metres
+        settle_time (float, optional): time before recording starts
+        periods (int, optional): periods of the lowest frequency recorded
+        frequencies_per_run (int, optional): tones per run, 1 for pure sines
+        arena (tuple, optional): a run that leaves it is marked invalid
+
+    Returns:
+        dict: frequency (F,) in Hz, response (a dict of (F,) complex transfer
+        functions from the input to each of OUTPUTS), valid (F,) for runs
+        that stayed finite and in the arena, saturation (F,) fraction of
+        recorded steps with a clipped motor command and, for the command
+        inputs, loop (F,) the loop gain and margins from loop_margins()
+    """
+    if input not in INPUTS:
+        raise ValueError(f"unknown input {input!r}, expected one of {INPUTS}")
+    if parameters is None:
+        parameters = Environment.setup_drone_parameters(None)
+    frequencies = np.unique(np.asarray(frequencies, dtype=float))
+    # long enough for the lowest frequency and to keep neighbours apart,
+    # measured between the bins they snap to, frequencies that share a bin
+    # are merged
+    window = periods / frequencies[0]
+    gaps = np.diff(np.unique(np.rint(frequencies * window))) / window
+    if len(gaps):
+        window = max(window, 1.5 / gaps.min())
+    record_steps = int(np.ceil(window / dt))
+    settle_steps = int(round(settle_time / dt))
+    bins, run, phase = multisine_plan(
+        frequencies, record_steps, dt, frequencies_per_run
+    )
+    n = run.max() + 1
+    tones = np.bincount(run)
+    scale = amplitude / np.sqrt(tones[run])
+
+    drones = BatchDrone.from_parameters(parameters, n)
+    drones.position[:] = target
+    if controller is None:
+        controller = BatchPID(n)
+    else:
+        controller.compress(np.arange(n))
+    hover(drones, controller)
+    targets = np.broadcast_to(np.asarray(target, dtype=float), (n, 2))
+
+    # time major records, the FFT runs down the contiguous time axis
+    outputs = {name: np.empty((record_steps, n)) for name in OUTPUTS}
+    injected = np.empty((record_steps, n))
+    low, high = arena
+    valid = np.ones(n, dtype=bool)
+    saturated = np.zeros(n)
+    omega = 2 * np.pi * bins / (record_steps * dt)
+    zeros = np.zeros((n, 2))
+
+    for k in range(settle_steps + record_steps):
+        # the recording window starts at phase zero of every tone
+        t = (k - settle_steps) * dt
+        d = np.bincount(run, scale * np.sin(omega * t + phase), minlength=n)
+        state = drones.get_state()
+        actions, _ = controller(state, targets, dt)
+        thrust = 0.5 * (actions[:, 0] + actions[:, 1])
+        moment = 0.5 * (actions[:, 1] - actions[:, 0])
+
+        wind = force = torque = None
+        if input == "thrust":
+            actions[:, 0] += d
+            actions[:, 1] += d
+        elif input == "moment":
+            actions[:, 0] -= d
+            actions[:, 1] += d
+        elif input == "torque":
+            torque = d
+        else:
+            vector = zeros.copy()
+            vector[:, int(input.endswith("y"))] = d
+            if input.startswith("wind"):
+                wind = vector
+            else:
+                force = vector
+
+        i = k - settle_steps
+        if i >= 0:
+            injected[i] = d
+            outputs["x"][i] = state[:, 0]
+            outputs["y"][i] = state[:, 1]
+            outputs["phi"][i] = state[:, 4]
+            outputs["thrust"][i] = thrust
+            outputs["moment"][i] = moment
+            saturated += ((actions <= 0) | (actions >= controller.max_action)).any(
+                axis=1
+            )
+            x = state[:, 0]
+            y = state[:, 1]
+            valid &= np.isfinite(state).all(axis=1)
+            valid &= (x > low) & (x < high) & (y > low) & (y < high)
+        drones.step(actions, dt, wind, force, torque)
+
+    # every tone sits on its own bin, the transfer function is the ratio of
+    # the output and input spectra at that bin in the tone's run
+    spectrum_in = np.fft.rfft(injected, axis=0)[bins, run]
+    response = {
+        name: np.fft.rfft(values, axis=0)[bins, run] / spectrum_in
+        for name, values in outputs.items()
+    }
+    result = {
+        "frequency": bins / (record_steps * dt),
+        "response": response,
+        "valid": valid[run],
+        "saturation": saturated[run] / record_steps,
+    }
+    if input in COMMAND_INPUTS:
+        command = response[input]
+        loop = -command / (1 + command)
+        result["loop"] = loop
+        result["margins"] = loop_margins(result["frequency"], loop)
+    return result
+
+
+def bode(response):
+    # gain in dB and unwrapped phase in degrees of a (F,) complex response
+    gain = 20 * np.log10(np.abs(response))
+    phase = np.degrees(np.unwrap(np.angle(response)))
+    return gain, phase
+
+
+def loop_margins(frequencies, loop):
+    """Gain and phase margins of a loop gain sampled at increasing frequencies.
+
+    Crossovers are interpolated linearly in log frequency between samples.
+    The phase is unwrapped, so a phase crossover is any crossing of -180
+    degrees modulo 360, and the phase margin is taken in (-180, 180].
+
+    Returns:
+        dict: gain_crossover (Hz) and phase_margin (degrees) at the first
+        crossing of unit gain, phase_crossover (Hz) and gain_margin (dB) at
+        the first crossing of -180 degrees, None where there is no crossing
+    """
+    gain, phase = bode(loop)
+    log_f = np.log(frequencies)
+    margins = {
+        "gain_crossover": None,
+        "phase_margin": None,
+        "phase_crossover": None,
+        "gain_margin": None,
+    }
+
+    def crossing(values, level, jumps=None):
+        # first index i with values[i] and values[i + 1] on both sides of
+        # level, skipping steps with the indices in jumps
+        above = values > level
+        change = above[:-1] != above[1:]
+        if jumps is not None:
+            change &= ~jumps
+        change = np.flatnonzero(change)
+        if not len(change):
+            return None
+        i = change[0]
+        w = (level - values[i]) / (values[i + 1] - values[i])
+        return i, w
+
+    found = crossing(gain, 0.0)
+    if found is not None:
+        i, w = found
+        margins["gain_crossover"] = float(
+            np.exp(log_f[i] + w * (log_f[i + 1] - log_f[i]))
+        )
+        margin = 180 + phase[i] + w * (phase[i + 1] - phase[i])
+        margins["phase_margin"] = float(180 - (180 - margin) % 360)
+    # distance from -180 modulo 360 in [-180, 180), zero at a crossover. The
+    # jump from 180 to -180 half a turn away is a wrap, not a crossing
+    offset = np.mod(phase, 360) - 180
+    jumps = np.abs(np.diff(offset)) > 180
+    found = crossing(offset, 0.0, jumps)
+    if found is not None:
+        i, w = found
+        margins["phase_crossover"] = float(
+            np.exp(log_f[i] + w * (log_f[i + 1] - log_f[i]))
+        )
+        margins["gain_margin"] = float(-(gain[i] + w * (gain[i + 1] - gain[i])))
+    return margins
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="closed loop frequency response")
+    parser.add_argument("--input", choices=INPUTS, default="moment")
+    parser.add_argument("--output", choices=OUTPUTS, default=None)
+    parser.add_argument("--amplitude", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--min-frequency", type=float, default=0.1)
+    parser.add_argument("--max-frequency", type=float, default=10.0)
+    parser.add_argument("--count", type=int, default=30)
+    parser.add_argument("--per-run", type=int, default=1)
+    args = parser.parse_args()
+
+    result = frequency_response(
+        Environment.setup_drone_parameters(args.seed),
+        np.geomspace(args.min_frequency, args.max_frequency, args.count),
+        input=args.input,
+        amplitude=args.amplitude,
+        frequencies_per_run=args.per_run,
+    )
+    if "loop" in result and args.output is None:
+        name, response = "loop", result["loop"]
+    else:
+        name = args.output or args.input
+        if name not in OUTPUTS:
+            name = "phi" if args.input == "torque" else "x"
+        response = result["response"][name]
+    gain, phase = bode(response)
+    print(f"{args.input} -> {name}")
+    print("   f [Hz]  gain [dB]  phase [deg]  saturation")
+    for row in zip(result["frequency"], gain, phase, result["saturation"]):
+        print("%9.3f %10.2f %12.1f %11.2f" % row)
+    if not result["valid"].all():
+        print("runs that left the arena:", result["frequency"][~result["valid"]])
+    if "margins" in result:
+        print(result["margins"])
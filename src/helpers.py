@@ -35,6 +35,15 @@ def box_line_collided(box, line):
     return False
 
 
+def box_box_collided(box_a, box_b):
+    # check if any of the lines of box_a cross the perimeter of box_b, both
+    # boxes in the corner order of Drone.box (TL, TR, BL, BR)
+    for i, j in ((0, 1), (1, 3), (3, 2), (2, 0)):
+        if box_line_collided(box_a, [*box_b[i], *box_b[j]]):
+            return True
+    return False
+
+
 def lines_collided(x1, y1, x2, y2, x3, y3, x4, y4):
     denominator = (y4 - y3) * (x2 - x1) - (x4 - x3) * (y2 - y1)
 
@@ -0,0 +1,237 @@
+# sensor and actuator latency as ring buffer delay lines
+#
+# a delay line keeps the last few samples of a signal in a preallocated ring
+# buffer and reads it `delay` seconds in the past. Delays that are not a whole
+# number of steps are read by linear interpolation between the two samples
+# around them. Jitter adds a uniform random delay in [0, jitter] to every
+# read, limited so that the output never goes back in time: a read is at most
+# one step older than the previous one, like a receiver that keeps the newest
+# sample it has.
+#
+# DelayLine delays one vector signal (a state or an action), BatchDelayLine
+# delays N of them with per run delays, for latency sweeps with BatchDrone.
+# push() stores a sample and draws the delay, read() interpolates the output
+# and has no side effects, so it can be called any number of times between
+# pushes. Neither allocates once constructed.
+import numpy as np
+
+
+def generator_words(rng):
+    # PCG64 state of a Generator as 10 floats, the layout of DrydenTurbulence
+    state = rng.bit_generator.state
+    words = [
+        (value >> shift) & 0xFFFFFFFF
+        for value in (state["state"]["state"], state["state"]["inc"])
+        for shift in (0, 32, 64, 96)
+    ]
+    return [*words, state["has_uint32"], state["uinteger"]]
+
+
+def generator_from_words(values):
+    # inverse of generator_words()
+    words = [int(v) for v in values[:8]]
+    rng = np.random.default_rng()
+    rng.bit_generator.state = {
+        "bit_generator": "PCG64",
+        "state": {
+            "state": sum(w << s for w, s in zip(words[:4], (0, 32, 64, 96))),
+            "inc": sum(w << s for w, s in zip(words[4:], (0, 32, 64, 96))),
+        },
+        "has_uint32": int(values[8]),
+        "uinteger": int(values[9]),
+    }
+    return rng
+
+
+class DelayLine:
+    def __init__(self, size, delay=0.0, jitter=0.0, dt=1.0 / 60, seed=None):
+        """
+        Args:
+            size (int): length of the delayed vector, 6 for a state
+            delay (float, optional): fixed delay in seconds
+            jitter (float, optional): width of the uniform random extra delay
+                in seconds
+            dt (float, optional): time between calls to step()
+            seed (optional): seed of the jitter generator
+        """
+        if delay < 0 or jitter < 0:
+            raise ValueError("delay and jitter must not be negative")
+        self.size = size
+        self.delay = delay / dt
+        self.jitter = jitter / dt
+        self.rng = np.random.default_rng(seed)
+        # room for the longest delay and the sample after it
+        self.capacity = int(np.ceil(self.delay + self.jitter)) + 2
+        self.buffer = np.zeros((self.capacity, size))
+        self.output = np.zeros(size)
+        self._scratch = np.zeros(size)
+        self.reset()
+
+    def reset(self, value=0.0):
+        # as if the signal had been `value` forever
+        self.buffer[:] = value
+        self.head = 0
+        self.last_delay = self.delay
+
+    def push(self, value):
+        # store the newest sample and draw the delay of the next read()
+        self.head = (self.head + 1) % self.capacity
+        self.buffer[self.head] = value
+        delay = self.delay
+        if self.jitter:
+            delay += self.jitter * self.rng.random()
+            delay = min(delay, self.last_delay + 1)
+        self.last_delay = delay
+
+    def read(self):
+        """Delayed sample as of the last push().
+
+        Returns:
+            np.ndarray: (size,) delayed sample, a buffer reused by the next call
+        """
+        delay = self.last_delay
+        whole = int(delay)
+        fraction = delay - whole
+        newer = self.buffer[(self.head - whole) % self.capacity]
+        if not fraction:
+            self.output[:] = newer
+            return self.output
+        older = self.buffer[(self.head - whole - 1) % self.capacity]
+        np.multiply(newer, 1 - fraction, out=self.output)
+        np.multiply(older, fraction, out=self._scratch)
+        self.output += self._scratch
+        return self.output
+
+    def step(self, value):
+        # push() then read()
+        self.push(value)
+        return self.read()
+
+    def snapshot(self):
+        # head, previous delay, buffer and jitter generator as a flat list
+        return [
+            self.head,
+            self.last_delay,
+            *self.buffer.ravel().tolist(),
+            *generator_words(self.rng),
+        ]
+
+    def restore(self, values):
+        # inverse of snapshot(), returns the number of values consumed
+        self.head = int(values[0])
+        self.last_delay = values[1]
+        size = 2 + self.buffer.size
+        self.buffer[:] = np.reshape(values[2:size], self.buffer.shape)
+        self.rng = generator_from_words(values[size : size + 10])
+        return size + 10
+
+
+class BatchDelayLine:
+    def __init__(self, n, size, delay=0.0, jitter=0.0, dt=1.0 / 60, seed=None):
+        """
+        Args:
+            n (int): number of delayed signals
+            size (int): length of every delayed vector
+            delay (float | np.ndarray, optional): scalar or (n,) delays in seconds
+            jitter (float | np.ndarray, optional): scalar or (n,) jitter widths
+                in seconds
+        """
+        self.n = n
+        self.size = size
+        self.delay = np.broadcast_to(np.asarray(delay, dtype=float) / dt, (n,)).copy()
+        self.jitter = np.broadcast_to(np.asarray(jitter, dtype=float) / dt, (n,)).copy()
+        if (self.delay < 0).any() or (self.jitter < 0).any():
+            raise ValueError("delay and jitter must not be negative")
+        self.rng = np.random.default_rng(seed)
+        self.capacity = int(np.ceil((self.delay + self.jitter).max())) + 2
+
+        # (capacity, n, size) ring buffer, gathered through a flat row view
+        self.buffer = np.zeros((self.capacity, n, size))
+        self._rows = self.buffer.reshape(self.capacity * n, size)
+        self.output = np.zeros((n, size))
+
+        # preallocated work arrays
+        self._run = np.arange(n)
+        self._delay = np.empty(n)
+        self._whole = np.empty(n)
+        self._fraction = np.empty(n)
+        # fraction repeated over the columns, numpy buffers a broadcast
+        # (n, 1) operand
+        self._weight = np.empty((n, size))
+        self._index = np.empty(n, dtype=np.intp)
+        self._older = np.empty((n, size))
+        self.reset()
+
+    def reset(self, value=0.0):
+        # value is a scalar, (size,) or (n, size)
+        self.buffer[:] = value
+        self.head = 0
+        self.last_delay = self.delay.copy()
+
+    def push(self, values):
+        # store the newest (n, size) samples and draw the delays of read()
+        self.head = (self.head + 1) % self.capacity
+        self.buffer[self.head] = values
+        delay = self._delay
+        if self.jitter.any():
+            self.rng.random(out=delay)
+            delay *= self.jitter
+            delay += self.delay
+            self.last_delay += 1
+            np.minimum(delay, self.last_delay, out=delay)
+        else:
+            delay[:] = self.delay
+        self.last_delay[:] = delay
+
+    def read(self):
+        """Delayed samples as of the last push().
+
+        Returns:
+            np.ndarray: (n, size) delayed samples, a buffer reused by the next call
+        """
+        delay = self.last_delay
+        np.floor(delay, out=self._whole)
+        np.subtract(delay, self._whole, out=self._fraction)
+        np.copyto(self._weight, self._fraction[:, None])
+        index = self._index
+        np.copyto(index, self._whole, casting="unsafe")
+        np.subtract(self.head, index, out=index)
+        index %= self.capacity
+        index *= self.n
+        index += self._run
+        # mode="wrap" writes straight to out, the default mode="raise"
+        # gathers into a temporary buffer first
+        np.take(self._rows, index, axis=0, out=self.output, mode="wrap")
+
+        # the slot before head 0 wraps around to the end of the buffer
+        index -= self.n
+        np.take(self._rows, index, axis=0, out=self._older, mode="wrap")
+        # output + fraction * (older - output)
+        self._older -= self.output
+        self._older *= self._weight
+        self.output += self._older
+        return self.output
+
+    def step(self, values):
+        # push() then read()
+        self.push(values)
+        return self.read()
+
+    def snapshot(self):
+        # head, previous delays, buffer and jitter generator as a flat list
+        return [
+            self.head,
+            *self.last_delay.tolist(),
+            *self.buffer.ravel().tolist(),
+            *generator_words(self.rng),
+        ]
+
+    def restore(self, values):
+        # inverse of snapshot(), returns the number of values consumed
+        self.head = int(values[0])
+        self.last_delay[:] = values[1 : 1 + self.n]
+        i = 1 + self.n
+        size = i + self.buffer.size
+        self.buffer[:] = np.reshape(values[i:size], self.buffer.shape)
+        self.rng = generator_from_words(values[size : size + 10])
+        return size + 10
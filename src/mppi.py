@@ -0,0 +1,197 @@
+# sampling based model predictive control (MPPI)
+#
+# every call samples K perturbed motor command sequences around the current
+# plan, rolls all of them out over the horizon at once with BatchDrone and
+# the known wind, and moves the plan towards the low cost samples. The plan
+# is shifted by one step between calls (warm start).
+#
+# the controller only sees get_state(), so it tracks the rotor speeds itself
+# by running the commands it sends through the rotor model.
+import numpy as np
+from .batch_drone import BatchDrone, GRAVITY
+
+
+class MPPIController:
+    def __init__(
+        self,
+        drone_parameters,
+        samples=1000,
+        horizon=40,
+        dt=1.0 / 60,
+        noise_std=0.15,
+        temperature=1.0,
+        position_weight=40.0,
+        velocity_weight=4.0,
+        attitude_weight=10.0,
+        angular_velocity_weight=1.0,
+        action_weight=1.0,
+        terminal_weight=10.0,
+        arena=(0.0, 8.0),
+        max_attitude=0.4,
+        seed=None,
+    ):
+        """
+        Args:
+            drone_parameters (tuple): Environment.setup_drone_parameters output
+                for the airframe being flown
+            samples (int, optional): number of sampled sequences K
+            horizon (int, optional): number of dt steps in each rollout
+            dt (float, optional): rollout time step, the control period
+            noise_std (float, optional): std of the motor command perturbations
+            temperature (float, optional): MPPI lambda, lower is greedier
+            arena (tuple, optional): bounds outside of which rollouts are penalised
+            max_attitude (float, optional): attitude in radians beyond which
+                rollouts are penalised, the counterpart of max_pitch_angle
+            seed (optional): seed for the sampling noise
+        """
+        self.samples = samples
+        self.horizon = horizon
+        self.dt = dt
+        self.noise_std = noise_std
+        self.temperature = temperature
+        self.position_weight = position_weight
+        self.velocity_weight = velocity_weight
+        self.attitude_weight = attitude_weight
+        self.angular_velocity_weight = angular_velocity_weight
+        self.action_weight = action_weight
+        self.terminal_weight = terminal_weight
+        self.arena = arena
+        self.max_attitude = max_attitude
+        self.rng = np.random.default_rng(seed)
+
+        self.model = BatchDrone.from_parameters(drone_parameters, samples)
+        # model of the real drone, one copy, used to track the rotor speeds
+        self.rotors = BatchDrone.from_parameters(drone_parameters, 1)
+
+        # throttle at which the two rotors together carry the weight
+        hover_speed = np.sqrt(
+            self.model.mass[0] * GRAVITY / (2 * self.model.thrust_coefficient[0])
+        )
+        self.hover_action = float(
+            np.clip(
+                (hover_speed - self.model.omega_b[0]) / self.model.rotor_constant[0],
+                0,
+                1,
+            )
+        )
+
+        # preallocated sampling and cost buffers
+        self.noise = np.empty((samples, horizon, 2))
+        self.actions = np.empty((samples, horizon, 2))
+        self.cost = np.empty(samples)
+        self.weights = np.empty(samples)
+        self._stage = np.empty(samples)
+        self._work = np.empty(samples)
+        self._outside = np.empty(samples, dtype=bool)
+        self._flag = np.empty(samples, dtype=bool)
+        self._mean = np.empty((horizon, 2))
+        self.reset()
+
+    def reset(self):
+        self.plan = np.full((self.horizon, 2), self.hover_action)
+        self.rotors.rotor_speed[:] = 0
+
+    def __call__(self, state, target_pos, dt, wind=(0, 0)):
+        """Compute the next motor commands.
+
+        Args:
+            state (tuple): [x, y, vx, vy, phi, phidot] from Drone.get_state()
+            target_pos (tuple): desired position [x_des, y_des]
+            dt (float): control period, should match the rollout dt
+            wind (tuple, optional): current wind vector, held over the horizon
+
+        Returns:
+            tuple: (u1, u2, err_x, err_y), the same contract as controller.controller
+        """
+        x, y, vx, vy, phi, phidot = state
+        target = np.asarray(target_pos, dtype=float)
+        wind = np.asarray(wind, dtype=float)
+
+        # sample perturbed sequences around the plan
+        self.rng.standard_normal(out=self.noise)
+        self.noise *= self.noise_std
+        np.add(self.plan, self.noise, out=self.actions)
+        np.clip(self.actions, 0, 1, out=self.actions)
+
+        # roll all of them out in parallel
+        model = self.model
+        model.set_state(state, self.rotors.rotor_speed[0])
+        self.cost[:] = 0
+        for t in range(self.horizon):
+            u = self.actions[:, t]
+            model.step(u, self.dt, wind)
+            stage = self.stage_cost(model, target, u)
+            if t == self.horizon - 1:
+                stage *= self.terminal_weight
+            self.cost += stage
+            self.cost += self.bounds_cost(model)
+
+        # softmin weights over the rollout costs
+        weights = self.weights
+        np.subtract(self.cost, self.cost.min(), out=weights)
+        weights *= -1 / self.temperature
+        np.exp(weights, out=weights)
+        weights /= weights.sum()
+        # the weights sum to one, so plan + sum w (actions - plan) is the
+        # weighted mean of the actions
+        np.matmul(
+            weights, self.actions.reshape(self.samples, -1), out=self._mean.ravel()
+        )
+        np.clip(self._mean, 0, 1, out=self.plan)
+
+        u1, u2 = self.plan[0]
+        self.rotors.step(self.plan[:1], dt)
+
+        # warm start, shift the plan by one step
+        self.plan[:-1] = self.plan[1:]
+        self.plan[-1] = self.plan[-2]
+
+        return u1, u2, x - target[0], y - target[1]
+
+    def stage_cost(self, model, target, u):
+        """Cost of every rollout for one step.
+
+        Written per component, reductions over the short axis are slow, and
+        into preallocated buffers.
+
+        Returns:
+            np.ndarray: (K,) costs, a buffer reused by the next call
+        """
+        cost = self._stage
+        work = self._work
+        cost[:] = 0
+        for values, offset, weight in (
+            (model.position[:, 0], target[0], self.position_weight),
+            (model.position[:, 1], target[1], self.position_weight),
+            (model.velocity[:, 0], 0.0, self.velocity_weight),
+            (model.velocity[:, 1], 0.0, self.velocity_weight),
+            (model.attitude, 0.0, self.attitude_weight),
+            (model.angular_velocity, 0.0, self.angular_velocity_weight),
+            (u[:, 0], self.hover_action, self.action_weight),
+            (u[:, 1], self.hover_action, self.action_weight),
+        ):
+            np.subtract(values, offset, out=work)
+            work *= work
+            work *= weight
+            cost += work
+        return cost
+
+    def bounds_cost(self, model):
+        # 1e4 for rollouts outside the arena or beyond the attitude limit
+        low, high = self.arena
+        x_t = model.position[:, 0]
+        y_t = model.position[:, 1]
+        work = self._work
+        outside = self._outside
+        flag = self._flag
+        np.minimum(x_t, y_t, out=work)
+        np.less(work, low, out=outside)
+        np.maximum(x_t, y_t, out=work)
+        np.greater(work, high, out=flag)
+        outside |= flag
+        np.abs(model.attitude, out=work)
+        np.greater(work, self.max_attitude, out=flag)
+        outside |= flag
+        np.copyto(work, outside)
+        work *= 1e4
+        return work
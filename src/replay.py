@@ -0,0 +1,91 @@
+# deterministic replay of flight logs written by Environment.start_recording
+#
+# the replayer drives a headless Environment with the recorded actions and
+# wind, so no controller or wind model is needed. Seeking restores the
+# nearest snapshot before the requested step and simulates at most
+# snapshot_interval steps from there.
+import time
+from pygame.math import Vector2
+from .environment import Environment
+from .flight_log import FlightLog
+
+
+class Replayer:
+    def __init__(self, path):
+        self.log = FlightLog(path)
+        self.dt = self.log.dt
+
+        self.environment = Environment(
+            render_mode=None, rand_dynamics_seed=self.log.seed
+        )
+        # the airframe comes from the log, not from the seed
+        self.environment.drone.reset(
+            Vector2(0, 0), Vector2(0, 0), 0, 0, *self.log.airframe
+        )
+        self.seek(0)
+
+    @property
+    def n_steps(self):
+        return self.log.n_steps
+
+    @property
+    def time(self):
+        return self.step_index * self.dt
+
+    def seek(self, step):
+        if not 0 <= step <= self.n_steps:
+            raise IndexError(f"step {step} outside of the log (0 to {self.n_steps})")
+        self.step_index, snapshot = self.log.snapshot_before(step)
+        self.environment.drone.restore(snapshot.tolist())
+        while self.step_index < step:
+            self.advance()
+
+    def seek_time(self, t):
+        self.seek(min(int(round(t / self.dt)), self.n_steps))
+
+    def advance(self):
+        # replay one recorded step, returns False at the end of the log
+        if self.step_index >= self.n_steps:
+            return False
+        u_1, u_2 = self.log.actions[self.step_index].tolist()
+        wind = Vector2(*self.log.wind[self.step_index].tolist())
+        self.environment.advance((u_1, u_2), wind)
+        self.step_index += 1
+        return True
+
+    def play(self, until=None, speed=None, viewer=None, callback=None):
+        """Replay from the current step.
+
+        Args:
+            until (int, optional): step to stop at. Defaults to the end of the log.
+            speed (float, optional): multiple of real time, None runs as fast
+                as possible
+            viewer (viewer.MultiViewer, optional): single drone viewer to
+                render to, at most one frame per viewer frame period
+            callback (callable, optional): called with (step, state) after
+                every step
+        """
+        until = self.n_steps if until is None else min(until, self.n_steps)
+        start_step = self.step_index
+        start_time = time.perf_counter()
+        next_frame = start_time
+
+        while self.step_index < until:
+            self.advance()
+            drone = self.environment.drone
+            if callback is not None:
+                callback(self.step_index, drone.get_state())
+
+            now = time.perf_counter()
+            if speed is not None:
+                # wait until the replay clock catches up with the log
+                due = start_time + (self.step_index - start_step) * self.dt / speed
+                if due > now:
+                    time.sleep(due - now)
+                    now = due
+
+            if viewer is not None and now >= next_frame:
+                if not viewer.handle_events():
+                    break
+                viewer.render_drones([drone])
+                next_frame = now + 1.0 / max(viewer.fps, 1)
@@ -0,0 +1,121 @@
+# sensor models for the drone state returned by Drone.get_state()
+#
+# the state tuple is split into three channels, each with its own
+# noise, bias, dropout probability and update rate:
+#   position  -> (x, y)
+#   velocity  -> (vx, vy)
+#   attitude  -> (phi, phidot)
+#
+# everything is batched: a SensorModel measures N drones at once from an
+# (N, 6) state array, using preallocated buffers so that a measurement
+# step does not allocate.
+import numpy as np
+
+STATE_SIZE = 6
+CHANNELS = ("position", "velocity", "attitude")
+# state indices covered by each channel, in get_state() order
+CHANNEL_INDICES = ((0, 1), (2, 3), (4, 5))
+
+
+class SensorChannel:
+    def __init__(self, noise_std=0.0, bias=0.0, dropout=0.0, rate=60.0):
+        # noise_std and bias are either a scalar or one value per component
+        self.noise_std = np.broadcast_to(np.asarray(noise_std, dtype=float), (2,))
+        self.bias = np.broadcast_to(np.asarray(bias, dtype=float), (2,))
+        self.dropout = float(dropout)
+        self.rate = float(rate)
+
+        if not 0 <= self.dropout < 1:
+            raise ValueError("dropout must be in [0, 1)")
+        if self.rate <= 0:
+            raise ValueError("rate must be positive")
+
+
+class SensorModel:
+    def __init__(
+        self,
+        n=1,
+        position: SensorChannel = None,
+        velocity: SensorChannel = None,
+        attitude: SensorChannel = None,
+        seed=None,
+    ):
+        self.n = n
+        self.channels = [
+            position if position is not None else SensorChannel(),
+            velocity if velocity is not None else SensorChannel(),
+            attitude if attitude is not None else SensorChannel(),
+        ]
+        self.rng = np.random.default_rng(seed)
+
+        # per-component noise and bias laid out in state order
+        self.noise_std = np.concatenate([c.noise_std for c in self.channels])
+        self.bias = np.concatenate([c.bias for c in self.channels])
+        self.dropout = np.array([c.dropout for c in self.channels])
+        self.period = np.array([1.0 / c.rate for c in self.channels])
+
+        # preallocated buffers
+        self.measurement = np.zeros((n, STATE_SIZE))
+        self.valid = np.zeros((n, len(CHANNELS)), dtype=bool)
+        self._noise = np.empty((n, STATE_SIZE))
+        self._draw = np.empty((n, len(CHANNELS)))
+        self._due = np.empty((n, len(CHANNELS)), dtype=bool)
+        self._elapsed = np.empty((n, len(CHANNELS)))
+        # per drone copies, a broadcast (3,) operand makes numpy buffer and
+        # allocate. The small tolerance lets a 60 Hz sensor fire every 1/60 s
+        self._period = np.tile(self.period, (n, 1))
+        self._dropout = np.tile(self.dropout, (n, 1))
+        self._noise_std = np.tile(self.noise_std, (n, 1))
+        self._bias = np.tile(self.bias, (n, 1))
+        self._threshold = self._period - 1e-9
+        self._component_valid = np.empty((n, STATE_SIZE), dtype=bool)
+
+        self.reset()
+
+    def reset(self):
+        self.measurement[:] = 0
+        self.valid[:] = False
+        # start every channel due so the first call produces a sample
+        self._timer = np.tile(self.period, (self.n, 1))
+
+    def measurement_variance(self):
+        # per-component measurement variance, in state order, for the estimators
+        return self.noise_std**2
+
+    def measure(self, states, dt):
+        """Sample all sensors for a batch of states.
+
+        Args:
+            states (np.ndarray): (N, 6) true states in get_state() order
+            dt (float): time since the previous call
+
+        Returns:
+            tuple: the (N, 6) measurement buffer and the (N, 3) mask of
+            channels that produced a new sample this call. Channels without
+            a new sample hold their previous value.
+        """
+        self._timer += dt
+        np.greater_equal(self._timer, self._threshold, out=self._due)
+        np.copyto(self._elapsed, self._due)
+        self._elapsed *= self._period
+        self._timer -= self._elapsed
+
+        self.rng.random(out=self._draw)
+        np.greater_equal(self._draw, self._dropout, out=self.valid)
+        self.valid &= self._due
+
+        self.rng.standard_normal(out=self._noise)
+        self._noise *= self._noise_std
+        self._noise += self._bias
+        self._noise += states
+
+        self._component_valid.reshape(self.n, len(CHANNELS), 2)[:] = self.valid[
+            :, :, None
+        ]
+        np.copyto(self.measurement, self._noise, where=self._component_valid)
+        return self.measurement, self.valid
+
+    def measure_state(self, state, dt):
+        # single drone convenience wrapper, returns a get_state() style tuple
+        measurement, valid = self.measure(np.asarray(state, dtype=float)[None], dt)
+        return tuple(measurement[0]), valid[0].copy()
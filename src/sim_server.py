@@ -0,0 +1,324 @@
+# datagram socket interface around Environment for external controllers
+#
+# the server sends the drone state and the target in a fixed layout packet
+# and expects the motor commands back, so a controller in another process or
+# language can fly the simulated drone. Packets are little endian:
+#
+#   state   (server -> client)  uint32 seq, uint32 flags, float64 time,
+#                               float64 x, y, vx, vy, phi, phidot, x_des, y_des
+#   command (client -> server)  uint32 seq, float64 u1, float64 u2
+#
+# the state is Environment.observe(), so it carries the sensor latency if
+# the environment has one. A command echoes the seq of the state it answers,
+# which gives the round trip latency. The client announces itself with a command of seq 0.
+#
+# lockstep: the simulation waits for the answer to every state before stepping
+# free:     the simulation runs in real time and uses the newest command
+#
+#   python -m src.sim_server server --mode lockstep
+#   python -m src.sim_server client
+import argparse
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+import numpy as np
+from .environment import Environment
+from .controller_worker import load_controller
+
+STATE_PACKET = struct.Struct("<IId8d")
+COMMAND_PACKET = struct.Struct("<Idd")
+FLAG_DONE = 1
+DEFAULT_ADDRESS = ("127.0.0.1", 9870)
+# socket timeouts sleep for at least about a millisecond, the free mode polls
+# for the last stretch before a step so rates above 1 kHz are kept
+SPIN_TIME = 0.002
+
+
+def make_socket(address):
+    # Unix datagram socket for a path, UDP otherwise
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+class SimServer:
+    def __init__(
+        self,
+        environment=None,
+        address=DEFAULT_ADDRESS,
+        mode="lockstep",
+        target=(4.0, 4.0),
+        rate=60.0,
+        timeout=0.1,
+        max_records=1000000,
+    ):
+        """
+        Args:
+            environment (Environment, optional): environment to drive, a
+                headless one is made by default
+            address (tuple | str, optional): (host, port) for UDP or a path
+                for a Unix socket
+            mode (str, optional): "lockstep" or "free"
+            target (tuple, optional): target position sent with every state
+            rate (float, optional): steps per second in free running mode
+            timeout (float, optional): lockstep wait before the state is sent again
+            max_records (int, optional): number of round trip latencies kept
+        """
+        if mode not in ("lockstep", "free"):
+            raise ValueError(f"unknown mode {mode!r}, expected 'lockstep' or 'free'")
+        self.environment = environment if environment is not None else Environment()
+        self.address = address
+        self.mode = mode
+        self.target = tuple(target)
+        self.rate = rate
+        self.timeout = timeout
+        self.dt = 1.0 / 60
+
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        self.socket = make_socket(address)
+        self.socket.bind(address)
+        self.client = None
+
+        self.seq = 0
+        self.action = (0.0, 0.0)
+        self.resent = 0
+        self.late = 0
+        self.latency = np.full(max_records, np.nan)
+        # send time of the last states, indexed by seq, for the free mode
+        self.sent_at = np.zeros(1024)
+        self.state_buffer = bytearray(STATE_PACKET.size)
+        self.command_buffer = bytearray(COMMAND_PACKET.size)
+
+    def wait_for_client(self, timeout=None):
+        # block until a client announces itself, returns its address
+        self.socket.settimeout(timeout)
+        while True:
+            size, client = self.socket.recvfrom_into(self.command_buffer)
+            if size == COMMAND_PACKET.size:
+                self.client = client
+                return client
+
+    def send_state(self, flags=0):
+        state = self.environment.observe()
+        STATE_PACKET.pack_into(
+            self.state_buffer,
+            0,
+            self.seq,
+            flags,
+            self.seq * self.dt,
+            *state,
+            *self.target,
+        )
+        self.socket.sendto(self.state_buffer, self.client)
+
+    def serve(self, steps=None):
+        """Run the simulation until `steps` steps or a keyboard interrupt.
+
+        Returns:
+            dict: the same as stats()
+        """
+        if self.client is None:
+            self.wait_for_client()
+        self.start_step = self.seq
+        self.start_time = time.perf_counter()
+        try:
+            if self.mode == "lockstep":
+                self.serve_lockstep(steps)
+            else:
+                self.serve_free(steps)
+        except KeyboardInterrupt:
+            pass
+        self.elapsed = time.perf_counter() - self.start_time
+        self.send_state(FLAG_DONE)
+        return self.stats()
+
+    def serve_lockstep(self, steps):
+        sock = self.socket
+        sock.settimeout(self.timeout)
+        buffer = self.command_buffer
+        latency = self.latency
+        end = None if steps is None else self.seq + steps
+        while end is None or self.seq < end:
+            self.seq += 1
+            sent = time.perf_counter()
+            self.send_state()
+            while True:
+                try:
+                    size = sock.recv_into(buffer)
+                except socket.timeout:
+                    # lost packet or slow client, ask again
+                    self.resent += 1
+                    self.send_state()
+                    continue
+                if size != COMMAND_PACKET.size:
+                    continue
+                seq, u1, u2 = COMMAND_PACKET.unpack_from(buffer)
+                if seq == self.seq:
+                    break
+            latency[self.seq % len(latency)] = time.perf_counter() - sent
+            self.action = (u1, u2)
+            self.environment.step(self.action)
+
+    def serve_free(self, steps):
+        sock = self.socket
+        buffer = self.command_buffer
+        sent_at = self.sent_at
+        period = 1.0 / self.rate
+        next_step = time.perf_counter()
+        end = None if steps is None else self.seq + steps
+        while end is None or self.seq < end:
+            self.environment.step(self.action)
+            self.seq += 1
+            sent_at[self.seq % len(sent_at)] = time.perf_counter()
+            self.send_state()
+
+            # take commands as they arrive until the next step is due, the
+            # newest one is used for that step
+            next_step += period
+            while True:
+                remaining = next_step - time.perf_counter()
+                if remaining <= 0:
+                    break
+                # a timeout of 0 makes the socket non blocking
+                sock.settimeout(max(remaining - SPIN_TIME, 0.0))
+                try:
+                    size = sock.recv_into(buffer)
+                except (socket.timeout, BlockingIOError):
+                    continue
+                if size != COMMAND_PACKET.size:
+                    continue
+                seq, u1, u2 = COMMAND_PACKET.unpack_from(buffer)
+                if 0 < seq <= self.seq and self.seq - seq < len(sent_at):
+                    self.latency[seq % len(self.latency)] = (
+                        time.perf_counter() - sent_at[seq % len(sent_at)]
+                    )
+                    if seq < self.seq:
+                        self.late += 1
+                    self.action = (u1, u2)
+
+            if time.perf_counter() - next_step > period:
+                # fell behind, do not try to catch up with a burst of steps
+                next_step = time.perf_counter()
+
+    def stats(self):
+        # steps per second and round trip latency percentiles in seconds
+        latency = self.latency[~np.isnan(self.latency)]
+        steps = self.seq - self.start_step
+        stats = {
+            "mode": self.mode,
+            "steps": steps,
+            "rate": steps / self.elapsed if self.elapsed > 0 else 0.0,
+            "resent": self.resent,
+            "late": self.late,
+        }
+        if len(latency):
+            p50, p99 = np.percentile(latency, [50, 99])
+            stats["latency"] = {
+                "p50": float(p50),
+                "p99": float(p99),
+                "max": float(latency.max()),
+            }
+        return stats
+
+    def close(self):
+        self.socket.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class SimClient:
+    def __init__(self, address=DEFAULT_ADDRESS):
+        """
+        Args:
+            address (tuple | str, optional): address of the SimServer
+        """
+        self.address = address
+        self.socket = make_socket(address)
+        self.directory = None
+        if isinstance(address, str):
+            # a Unix datagram client needs an address of its own for replies,
+            # bound in a private directory so the name cannot be taken first
+            self.directory = tempfile.mkdtemp(prefix="sim_client_")
+            self.socket.bind(os.path.join(self.directory, "client.sock"))
+        self.state_buffer = bytearray(STATE_PACKET.size)
+        self.command_buffer = bytearray(COMMAND_PACKET.size)
+        self.send(0, 0.0, 0.0)
+
+    def receive(self):
+        """Wait for the next state.
+
+        Returns:
+            tuple: (seq, flags, time, state, target) with the state in
+            Drone.get_state() order
+        """
+        while True:
+            size = self.socket.recv_into(self.state_buffer)
+            if size == STATE_PACKET.size:
+                break
+        seq, flags, t, *values = STATE_PACKET.unpack_from(self.state_buffer)
+        return seq, flags, t, tuple(values[:6]), tuple(values[6:])
+
+    def send(self, seq, u1, u2):
+        COMMAND_PACKET.pack_into(self.command_buffer, 0, seq, u1, u2)
+        self.socket.sendto(self.command_buffer, self.address)
+
+    def run(self, controller, dt=1.0 / 60):
+        """Answer states with controller(state, target_pos, dt) until the
+        server is done. The controller returns (u1, u2, ...) like
+        controller.controller.
+
+        Returns:
+            int: number of commands sent
+        """
+        count = 0
+        while True:
+            seq, flags, _, state, target = self.receive()
+            if flags & FLAG_DONE:
+                return count
+            action = controller(state, target, dt)
+            self.send(seq, action[0], action[1])
+            count += 1
+
+    def close(self):
+        self.socket.close()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def parse_address(text):
+    # "host:port" for UDP, anything else is a Unix socket path
+    host, _, port = text.rpartition(":")
+    if host and port.isdigit():
+        return (host, int(port))
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="socket interface around Environment")
+    parser.add_argument("role", choices=["server", "client"])
+    parser.add_argument("--address", default="127.0.0.1:9870")
+    parser.add_argument("--mode", choices=["lockstep", "free"], default="lockstep")
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=60.0)
+    parser.add_argument("--target", type=float, nargs=2, default=(4.0, 4.0))
+    parser.add_argument("--controller", default="controller.py")
+    args = parser.parse_args()
+    address = parse_address(args.address)
+
+    if args.role == "server":
+        server = SimServer(
+            address=address, mode=args.mode, target=args.target, rate=args.rate
+        )
+        print("waiting for a client on", address)
+        server.wait_for_client()
+        print(server.serve(args.steps))
+        server.close()
+    else:
+        module = load_controller(args.controller)
+        client = SimClient(address)
+        print("commands sent:", client.run(module.controller))
+        client.close()
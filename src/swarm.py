@@ -0,0 +1,215 @@
+# many drones sharing the arena and the wind
+#
+# every drone has its own airframe and its own controller state, the
+# controllers are independent copies of controller.py (or whatever a factory
+# returns) so their module level integrators do not interfere.
+#
+# drone-drone collisions use a sort and sweep broadphase on the axis aligned
+# bounds of the rotated boxes, and the exact box test from helpers only runs
+# on the pairs whose bounds overlap.
+import numpy as np
+from pygame.math import Vector2
+from .drone import Drone
+from .wind import Wind
+from .wall import arena_walls
+from .environment import Environment
+from .controller_worker import load_controller
+from . import helpers
+
+
+def overlapping_pairs(lower, upper):
+    """Pairs of axis aligned boxes that overlap, by sort and sweep on x.
+
+    Args:
+        lower (np.ndarray): (N, 2) minimum corners
+        upper (np.ndarray): (N, 2) maximum corners
+
+    Returns:
+        np.ndarray: (K, 2) indices i < j of overlapping boxes
+    """
+    order = np.argsort(lower[:, 0], kind="stable")
+    min_x = lower[order, 0]
+    max_x = upper[order, 0]
+    # every box overlaps in x with the boxes that start before it ends
+    end = np.searchsorted(min_x, max_x, side="right")
+    start = np.arange(len(order)) + 1
+    counts = np.maximum(end - start, 0)
+    total = counts.sum()
+    if total == 0:
+        return np.empty((0, 2), dtype=int)
+    first = np.repeat(np.arange(len(order)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + offsets
+    a = order[first]
+    b = order[second]
+
+    # keep the pairs that also overlap in y
+    keep = (lower[a, 1] <= upper[b, 1]) & (lower[b, 1] <= upper[a, 1])
+    pairs = np.stack([a[keep], b[keep]], axis=1)
+    pairs.sort(axis=1)
+    return pairs
+
+
+class MultiDroneEnvironment:
+    def __init__(
+        self,
+        n,
+        controller_path="controller.py",
+        controller_factory=None,
+        rand_dynamics_seeds=None,
+        positions=None,
+        wind_active=False,
+        turbulence_intensity=0,
+        wind_field=None,
+        freeze_on_collision=True,
+        wind_seed=None,
+    ):
+        """
+        Args:
+            n (int): number of drones
+            controller_path (str, optional): controller file, loaded once per drone
+            controller_factory (callable, optional): returns a new
+                controller(state, target_pos, dt) per call, used instead of
+                controller_path
+            rand_dynamics_seeds (list, optional): airframe seed per drone,
+                None draws random airframes
+            positions (np.ndarray, optional): (n, 2) start positions in metres,
+                a grid over the arena by default
+            wind_field (wind_field.WindField, optional): spatially varying wind
+                sampled at every drone, replaces the shared wind model
+            freeze_on_collision (bool, optional): stop stepping drones that hit
+                a wall or another drone
+            wind_seed (int, optional): seed of the shared wind model, None
+                draws fresh entropy
+        """
+        self.n = n
+        self.dt = 1.0 / 60
+        self.wind_active = wind_active
+        self.wind = Wind(5, 1, 0.1, turbulence_intensity, seed=wind_seed)
+        self.wind_field = wind_field
+        self.wind_vector = Vector2(0, 0)
+        self.freeze_on_collision = freeze_on_collision
+        self.walls = arena_walls()
+        self.steps = 0
+
+        if rand_dynamics_seeds is None:
+            rand_dynamics_seeds = [None] * n
+        if positions is None:
+            positions = self.grid_positions(n)
+        self.drone_parameters = []
+        self.drones = []
+        for seed, position in zip(rand_dynamics_seeds, positions):
+            parameters = (
+                Vector2(float(position[0]), float(position[1])),
+                *Environment.setup_drone_parameters(seed)[1:],
+            )
+            self.drone_parameters.append(parameters)
+            drone = Drone(*parameters)
+            drone.update_box()
+            self.drones.append(drone)
+
+        if controller_factory is None:
+            self.controllers = [
+                load_controller(controller_path).controller for _ in range(n)
+            ]
+        else:
+            self.controllers = [controller_factory() for _ in range(n)]
+
+        self.active = np.ones(n, dtype=bool)
+        self.crashed_into_ground = np.zeros(n, dtype=bool)
+        self.collisions = np.empty((0, 2), dtype=int)
+        self.errors = np.zeros((n, 2))
+
+    @staticmethod
+    def grid_positions(n, low=1.0, high=7.0):
+        # start positions on a square grid inside the arena
+        columns = int(np.ceil(np.sqrt(n)))
+        rows = int(np.ceil(n / columns))
+        x = np.linspace(low, high, columns) if columns > 1 else np.array([4.0])
+        y = np.linspace(low, high, rows) if rows > 1 else np.array([4.0])
+        grid = np.stack(np.meshgrid(x, y), axis=-1).reshape(-1, 2)
+        return grid[:n]
+
+    def get_states(self):
+        # (n, 6) array in Drone.get_state() order
+        return np.array([drone.get_state() for drone in self.drones])
+
+    def positions(self):
+        return np.array([(d.position_m.x, d.position_m.y) for d in self.drones])
+
+    def step(self, targets):
+        """Run every active drone's controller and advance the drones.
+
+        Args:
+            targets (np.ndarray): (n, 2) target positions, or one (2,) for all
+
+        Returns:
+            np.ndarray: (K, 2) drone pairs that collided during this step, pairs
+            of drones that were both frozen before it are not reported again
+        """
+        targets = np.broadcast_to(np.asarray(targets, dtype=float), (self.n, 2))
+        winds = None
+        if not self.wind_active:
+            self.wind_vector = Vector2(0, 0)
+        elif self.wind_field is not None:
+            # one gather for every drone
+            winds = self.wind_field.sample(
+                self.steps * self.dt, self.positions()
+            ).tolist()
+        else:
+            self.wind_vector = self.wind.get_wind(self.dt)
+
+        for i in np.flatnonzero(self.active):
+            drone = self.drones[i]
+            target = (targets[i, 0], targets[i, 1])
+            action = self.controllers[i](drone.get_state(), target, self.dt)
+            self.errors[i] = action[2], action[3]
+            wind_vector = self.wind_vector if winds is None else Vector2(*winds[i])
+            drone.step(action, self.dt, wind_vector)
+        self.steps += 1
+
+        self.collisions = self.check_collisions()
+        return self.collisions
+
+    def bounds(self):
+        # (n, 2) lower and upper corners of the rotated boxes, in pixels
+        centre = np.array([d.position_px for d in self.drones])
+        attitude = np.array([d.attitude for d in self.drones])
+        size = np.array([(d.width_px, d.height_px) for d in self.drones]) / 2
+        cos = np.abs(np.cos(attitude))
+        sin = np.abs(np.sin(attitude))
+        half = np.stack(
+            [cos * size[:, 0] + sin * size[:, 1], sin * size[:, 0] + cos * size[:, 1]],
+            axis=1,
+        )
+        return centre - half, centre + half
+
+    def check_collisions(self):
+        # drone-drone pairs and walls, exact tests only on broadphase candidates
+        # that involve a drone active during this step, frozen drones do not move
+        lower, upper = self.bounds()
+        candidates = overlapping_pairs(lower, upper)
+        candidates = candidates[self.active[candidates].any(axis=1)]
+        hits = [
+            (i, j)
+            for i, j in candidates.tolist()
+            if helpers.box_box_collided(self.drones[i].box, self.drones[j].box)
+            or helpers.box_box_collided(self.drones[j].box, self.drones[i].box)
+        ]
+        pairs = np.array(hits, dtype=int).reshape(-1, 2)
+
+        # only drones whose bounds leave the arena can touch its walls
+        outside = (lower.min(axis=1) <= 0) | (upper.max(axis=1) >= 800)
+        for i in np.flatnonzero(outside & self.active):
+            collided, ground = self.drones[i].check_collision(self.walls)
+            if collided and self.freeze_on_collision:
+                self.active[i] = False
+                self.crashed_into_ground[i] = ground
+
+        if self.freeze_on_collision and len(pairs):
+            self.active[pairs.ravel()] = False
+        return pairs
+
+    def render(self, viewer, targets=None):
+        # draw with a viewer.MultiViewer in overlay layout
+        viewer.render_drones(self.drones, targets)
@@ -0,0 +1,234 @@
+# batched system identification of the airframe parameters
+#
+# given the states before and after every step and the motor commands, the
+# equations of Drone.step are linear in the unknowns once the rotor speeds
+# are known:
+#
+#   (v[k+1] - v[k]) / dt - g = (1/m) T(k) [sin(phi), -cos(phi)]
+#                              - (Cd A / m) 0.5 rho |r| r
+#   (w[k+1] - w[k]) / dt     = (1/J) (T1(k) - T2(k)) l
+#
+# with r the air relative velocity. Only the product Cd A is identifiable.
+# The rotor speeds depend on the rotor time constant, so the fit is repeated
+# over a grid of time constants, the one with the smallest residual is kept
+# and refined with a parabola through its neighbours. Every log in the batch
+# is fitted at once, the least squares problems are solved in closed form.
+import numpy as np
+from .batch_drone import GRAVITY
+
+DEFAULT_TIME_CONSTANTS = np.geomspace(0.02, 0.2, 25)
+
+
+def dot(a, b):
+    # per log dot product over the time axis of two (T, N) arrays
+    return np.einsum("tn,tn->n", a, b)
+
+
+def rotor_thrust(
+    actions,
+    rotor_time_constant,
+    dt,
+    thrust_coefficient=1.984e-7,
+    rotor_constant=6432,
+    omega_b=1779,
+    rotor_speed=0,
+):
+    """Thrust of both rotors after every step, as in Rotor.step.
+
+    Args:
+        actions (np.ndarray): (N, T, 2) motor commands
+        rotor_time_constant (float | np.ndarray): scalar or (N,)
+        rotor_speed (float | np.ndarray, optional): speeds before the first
+            step, scalar, (N,) or (N, 2). A new Drone starts at 0.
+
+    Returns:
+        tuple: (thrust_1, thrust_2), each (T, N), time major
+    """
+    # time major, (T, 2, N), so every step works on one contiguous block
+    desired = np.ascontiguousarray(np.moveaxis(actions, (1, 2), (0, 1)))
+    desired = np.clip(desired, 0, 1) * rotor_constant + omega_b
+    gain = dt / np.asarray(rotor_time_constant, dtype=float)
+    speed = np.asarray(rotor_speed, dtype=float)
+    speed = np.broadcast_to(speed.T if speed.ndim == 2 else speed, (2, len(actions)))
+    speed = speed.copy()
+    speeds = np.empty_like(desired)
+    for k in range(len(desired)):
+        speed += (desired[k] - speed) * gain
+        speeds[k] = speed
+    thrust = thrust_coefficient * speeds**2
+    return thrust[:, 0], thrust[:, 1]
+
+
+class RigidBodyFit:
+    # the parts of the least squares problems that do not depend on the
+    # rotor time constant, computed once per batch of logs
+    def __init__(self, states, dt, wind=None, air_density=1.225, arm_length=0.25):
+        """
+        Args:
+            states (np.ndarray): (N, T + 1, 6) states in Drone.get_state() order
+            wind (np.ndarray, optional): (N, T, 2) wind vectors
+        """
+        self.arm_length = arm_length
+        # time major, reductions over the long leading axis are cheap
+        states = np.ascontiguousarray(np.moveaxis(states, 1, 0))
+        vx = states[:-1, :, 2]
+        vy = states[:-1, :, 3]
+        phi = states[:-1, :, 4]
+        self.ax = (states[1:, :, 2] - vx) / dt
+        self.ay = (states[1:, :, 3] - vy) / dt - GRAVITY
+        self.alpha = (states[1:, :, 5] - states[:-1, :, 5]) / dt
+        self.sin = np.sin(phi)
+        self.cos = np.cos(phi)
+
+        if wind is None:
+            rx, ry = vx, vy
+        else:
+            wind = np.asarray(wind, dtype=float)
+            rx = vx - wind[..., 0].T
+            ry = vy - wind[..., 1].T
+        half_rho_speed = -0.5 * air_density * np.sqrt(rx * rx + ry * ry)
+        self.drag_x = half_rho_speed * rx
+        self.drag_y = half_rho_speed * ry
+
+        self.a22 = dot(self.drag_x, self.drag_x) + dot(self.drag_y, self.drag_y)
+        self.b2 = dot(self.drag_x, self.ax) + dot(self.drag_y, self.ay)
+        self.yy = dot(self.ax, self.ax) + dot(self.ay, self.ay)
+        self.aa = dot(self.alpha, self.alpha)
+        # x, y projection of the drag regressor on the thrust direction
+        self.drag_along = self.sin * self.drag_x - self.cos * self.drag_y
+        self.accel_along = self.sin * self.ax - self.cos * self.ay
+
+    def fit(self, thrust_1, thrust_2):
+        """Least squares fit of 1/m, Cd A / m and 1/J for known rotor thrust.
+
+        Returns:
+            tuple: (inverse_mass, drag_over_mass, inverse_inertia, residual),
+            all (N,). The residual is the unexplained fraction of the squared
+            accelerations, summed over the translational and rotational fits.
+        """
+        total = thrust_1 + thrust_2
+        torque = (thrust_1 - thrust_2) * self.arm_length
+
+        # normal equations of the 2 parameter translational problem
+        a11 = dot(total, total)
+        a12 = dot(total, self.drag_along)
+        a22 = self.a22
+        b1 = dot(total, self.accel_along)
+        b2 = self.b2
+        determinant = a11 * a22 - a12 * a12
+        # without airspeed the drag column is zero, fall back to thrust only
+        solvable = determinant > 1e-12 * a11 * a22
+        safe = np.where(solvable, determinant, 1)
+        inverse_mass = np.where(solvable, (a22 * b1 - a12 * b2) / safe, b1 / a11)
+        drag_over_mass = np.where(solvable, (a11 * b2 - a12 * b1) / safe, 0)
+        translational = (self.yy - inverse_mass * b1 - drag_over_mass * b2) / self.yy
+
+        # single parameter rotational problem
+        tt = dot(torque, torque)
+        ta = dot(torque, self.alpha)
+        inverse_inertia = ta / tt
+        rotational = (self.aa - inverse_inertia * ta) / np.where(
+            self.aa > 0, self.aa, 1
+        )
+
+        residual = np.maximum(translational, 0) + np.maximum(rotational, 0)
+        return inverse_mass, drag_over_mass, inverse_inertia, residual
+
+
+def identify(
+    states,
+    actions,
+    dt=1.0 / 60,
+    wind=None,
+    rotor_speed=0,
+    time_constants=DEFAULT_TIME_CONSTANTS,
+    thrust_coefficient=1.984e-7,
+    rotor_constant=6432,
+    omega_b=1779,
+    air_density=1.225,
+    arm_length=0.25,
+):
+    """Estimate the airframe of N logs of equal length at once.
+
+    The rotor constants are the fixed values of setup_drone_parameters and are
+    taken as known.
+
+    Args:
+        states (np.ndarray): (N, T + 1, 6) states before every step and after
+            the last one, in Drone.get_state() order
+        actions (np.ndarray): (N, T, 2) motor commands
+        dt (float, optional): time step of the logs
+        wind (np.ndarray, optional): (N, T, 2) wind vectors passed to each step
+        rotor_speed (optional): rotor speeds before the first step
+        time_constants (np.ndarray, optional): increasing, log spaced grid of
+            rotor time constants to search
+
+    Returns:
+        dict: (N,) arrays mass, rotational_inertia, drag_area (the product
+        drag_coefficient * reference_area), rotor_time_constant and residual
+    """
+    states = np.asarray(states, dtype=float)
+    actions = np.asarray(actions, dtype=float)
+    if states.ndim == 2:
+        states, actions = states[None], actions[None]
+        wind = None if wind is None else np.asarray(wind)[None]
+        rotor_speed = np.asarray(rotor_speed, dtype=float).reshape(1, -1)
+    time_constants = np.asarray(time_constants, dtype=float)
+    rotor = dict(
+        thrust_coefficient=thrust_coefficient,
+        rotor_constant=rotor_constant,
+        omega_b=omega_b,
+        rotor_speed=rotor_speed,
+    )
+    body = RigidBodyFit(states, dt, wind, air_density, arm_length)
+
+    residuals = np.empty((len(time_constants), len(states)))
+    for i, tau in enumerate(time_constants):
+        residuals[i] = body.fit(*rotor_thrust(actions, tau, dt, **rotor))[3]
+
+    # parabola through the best grid point and its neighbours, in log(tau)
+    best = np.clip(residuals.argmin(axis=0), 1, len(time_constants) - 2)
+    columns = np.arange(len(states))
+    r0 = residuals[best - 1, columns]
+    r1 = residuals[best, columns]
+    r2 = residuals[best + 1, columns]
+    curvature = r0 - 2 * r1 + r2
+    offset = np.where(
+        curvature > 0, 0.5 * (r0 - r2) / np.where(curvature > 0, curvature, 1), 0
+    )
+    offset = np.clip(offset, -1, 1)
+    log_tau = np.log(time_constants)
+    step = np.where(offset < 0, log_tau[best] - log_tau[best - 1], 0) + np.where(
+        offset > 0, log_tau[best + 1] - log_tau[best], 0
+    )
+    tau = np.exp(log_tau[best] + offset * step)
+
+    inverse_mass, drag_over_mass, inverse_inertia, residual = body.fit(
+        *rotor_thrust(actions, tau, dt, **rotor)
+    )
+    mass = 1 / inverse_mass
+    return {
+        "mass": mass,
+        "rotational_inertia": 1 / inverse_inertia,
+        "drag_area": drag_over_mass * mass,
+        "rotor_time_constant": tau,
+        "residual": residual,
+    }
+
+
+def flight_log_arrays(path):
+    """Replay a log written by Environment.start_recording into arrays.
+
+    Returns:
+        tuple: (states (T + 1, 6), actions (T, 2), wind (T, 2), rotor_speed (2,))
+        ready to be stacked for identify()
+    """
+    from .replay import Replayer
+
+    replayer = Replayer(path)
+    states = [replayer.environment.drone.get_state()]
+    replayer.play(callback=lambda step, state: states.append(state))
+    log = replayer.log
+    # rotor speeds are entries 7 and 10 of Drone.snapshot()
+    rotor_speed = log.snapshots[0][[7, 10]]
+    return np.array(states), log.actions.copy(), log.wind.copy(), rotor_speed
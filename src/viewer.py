@@ -0,0 +1,199 @@
+# viewer for watching many simulations in one window
+#
+# two layouts are supported:
+#   "grid"     -> one tile per run, each tile a scaled copy of the 8x8 m arena
+#   "overlay"  -> every run drawn in one arena, told apart by colour
+#
+# the drone sprite is tinted once per colour and pre-rotated into angle
+# bins, so a frame is one background blit plus a single Surface.blits()
+# call for all drones and targets.
+import numpy as np
+import pygame
+import pathlib
+
+ARENA_PX = 800  # arena size in pixels at the scale used by Environment
+PALETTE = [
+    (31, 119, 180),
+    (255, 127, 14),
+    (44, 160, 44),
+    (214, 39, 40),
+    (148, 103, 189),
+    (140, 86, 75),
+    (227, 119, 194),
+    (127, 127, 127),
+    (188, 189, 34),
+    (23, 190, 207),
+]
+
+
+class MultiViewer:
+    def __init__(
+        self,
+        n,
+        layout="grid",
+        screen_width=1000,
+        screen_height=800,
+        columns=None,
+        colors=None,
+        angle_step=2,
+        labels=None,
+        fps=60,
+    ):
+        if layout not in ("grid", "overlay"):
+            raise ValueError("layout must be 'grid' or 'overlay'")
+
+        self.n = n
+        self.layout = layout
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.angle_step = angle_step
+        self.n_bins = int(round(360 / angle_step))
+        self.fps = fps
+
+        pygame.init()
+        self.screen = pygame.display.set_mode((screen_width, screen_height))
+        pygame.display.set_caption("AMR Assignment 3")
+        self.clock = pygame.time.Clock()
+
+        self.setup_layout(columns)
+
+        # one colour per run, cycling through the palette by default
+        if colors is None:
+            colors = [PALETTE[i % len(PALETTE)] for i in range(n)]
+        self.palette = list(dict.fromkeys(tuple(c) for c in colors))
+        self.color_index = np.array(
+            [self.palette.index(tuple(c)) for c in colors], dtype=int
+        )
+
+        sprite = pygame.image.load(
+            str(pathlib.Path(__file__).parents[1].resolve()) + "/images/drone.png"
+        ).convert_alpha()
+        self.build_sprites(sprite)
+        self.build_background(labels)
+
+    def setup_layout(self, columns):
+        if self.layout == "overlay":
+            side = min(self.screen_width, self.screen_height)
+            self.columns = self.rows = 1
+            self.tile_size = side
+            self.tile_origin = np.zeros((self.n, 2))
+        else:
+            if columns is None:
+                aspect = self.screen_width / self.screen_height
+                columns = max(1, int(np.ceil(np.sqrt(self.n * aspect))))
+            self.columns = columns
+            self.rows = int(np.ceil(self.n / columns))
+            self.tile_size = min(
+                self.screen_width // self.columns, self.screen_height // self.rows
+            )
+            index = np.arange(self.n)
+            self.tile_origin = (
+                np.stack([index % self.columns, index // self.columns], axis=1)
+                * self.tile_size
+            ).astype(float)
+        self.scale = self.tile_size / ARENA_PX
+
+    def build_sprites(self, sprite):
+        # scale the sprite to the tile, keeping at least a few pixels visible
+        width, height = sprite.get_size()
+        size = (
+            max(6, int(round(width * self.scale))),
+            max(2, int(round(height * self.scale))),
+        )
+        sprite = pygame.transform.smoothscale(sprite, size)
+
+        # sprites[colour][bin] and the offset from the centre to the top left
+        self.sprites = []
+        self.offsets = np.empty((len(self.palette), self.n_bins, 2))
+        for c, color in enumerate(self.palette):
+            tinted = sprite.copy()
+            tinted.fill(color, special_flags=pygame.BLEND_RGB_ADD)
+            rotated = []
+            for b in range(self.n_bins):
+                image = pygame.transform.rotate(tinted, b * self.angle_step)
+                rotated.append(image)
+                self.offsets[c, b] = np.array(image.get_size()) / 2
+            self.sprites.append(rotated)
+
+        radius = max(2, int(round(5 * self.scale)))
+        self.target_sprites = []
+        for color in self.palette:
+            image = pygame.Surface((2 * radius, 2 * radius), pygame.SRCALPHA)
+            pygame.draw.circle(image, color, (radius, radius), radius)
+            self.target_sprites.append(image)
+        self.target_offset = radius
+
+    def build_background(self, labels):
+        self.background = pygame.Surface((self.screen_width, self.screen_height))
+        self.background.fill((211, 211, 211))
+        font = pygame.font.SysFont(None, max(12, int(self.tile_size / 8)))
+        for i in range(self.columns * self.rows if self.layout == "grid" else 1):
+            x = (i % self.columns) * self.tile_size
+            y = (i // self.columns) * self.tile_size
+            rect = pygame.Rect(x, y, self.tile_size, self.tile_size)
+            pygame.draw.rect(self.background, (243, 243, 243), rect)
+            pygame.draw.rect(self.background, (180, 180, 180), rect, 1)
+            if labels is not None and self.layout == "grid" and i < self.n:
+                text = font.render(str(labels[i]), True, (90, 90, 90))
+                self.background.blit(text, (x + 3, y + 2))
+
+    def render(self, positions, attitudes, targets=None):
+        """Draw one frame.
+
+        Args:
+            positions (np.ndarray): (N, 2) drone positions in metres
+            attitudes (np.ndarray): (N,) drone attitudes in radians
+            targets (np.ndarray, optional): (N, 2) or (2,) target positions in metres
+        """
+        pixels_per_metre = 100 * self.scale
+        centre = self.tile_origin + np.asarray(positions) * pixels_per_metre
+
+        # same rotation as Environment.render: -attitude in degrees
+        degrees = np.degrees(-np.asarray(attitudes))
+        bins = np.rint(degrees / self.angle_step).astype(int) % self.n_bins
+        topleft = np.rint(centre - self.offsets[self.color_index, bins]).astype(int)
+
+        sequence = [
+            (self.sprites[c][b], (x, y))
+            for c, b, (x, y) in zip(
+                self.color_index.tolist(), bins.tolist(), topleft.tolist()
+            )
+        ]
+
+        if targets is not None:
+            targets = np.broadcast_to(np.asarray(targets, dtype=float), (self.n, 2))
+            if self.layout == "overlay" and (targets == targets[0]).all():
+                # a shared target only needs drawing once
+                target_px = targets[:1] * pixels_per_metre - self.target_offset
+                colors = [0]
+            else:
+                target_px = (
+                    self.tile_origin + targets * pixels_per_metre - self.target_offset
+                )
+                colors = self.color_index.tolist()
+            sequence += [
+                (self.target_sprites[c], (x, y))
+                for c, (x, y) in zip(colors, np.rint(target_px).astype(int).tolist())
+            ]
+
+        self.screen.blit(self.background, (0, 0))
+        self.screen.blits(sequence, doreturn=False)
+
+        pygame.display.flip()
+        self.clock.tick(self.fps)
+
+    def render_drones(self, drones, targets=None):
+        # convenience wrapper for a list of Drone objects
+        positions = np.array([(d.position_m.x, d.position_m.y) for d in drones])
+        attitudes = np.array([d.attitude for d in drones])
+        self.render(positions, attitudes, targets)
+
+    def handle_events(self):
+        # returns False once the window has been closed
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+        return True
+
+    def close(self):
+        pygame.quit()
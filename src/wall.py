@@ -15,3 +15,13 @@ class Wall:
         ).normalize()
         self.c_restitution = c_restitution
         self.is_ground = is_ground
+
+
+def arena_walls(width_px=800, height_px=800, c_restitution=0.0):
+    # the four edges of the arena, in pixels, with the bottom one as ground
+    return [
+        Wall([0, height_px, width_px, height_px], c_restitution, is_ground=True),
+        Wall([0, 0, width_px, 0], c_restitution),
+        Wall([0, 0, 0, height_px], c_restitution),
+        Wall([width_px, 0, width_px, height_px], c_restitution),
+    ]
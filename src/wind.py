@@ -6,26 +6,206 @@
 #
 # the wind field is defined by three contibutions:
 # 1 steady state wind (same as base model)
-# 2 continuous turbulence (TODO)
+# 2 continuous turbulence (Dryden model, see DrydenTurbulence)
 # 3 discrete gusts (based on 1-cos() theory)
+import copy
 import numpy as np
 import pygame.math as math
 import random
 
 
+def first_order_filter(x, a, y0):
+    # y[k] = a * y[k-1] + (1 - a) * x[k] along the last axis, starting from y0.
+    # solved as a scan in log2(n) vectorized passes instead of a python loop
+    y = (1 - a) * x
+    y[..., 0] += a * y0
+    shift = 1
+    while shift < y.shape[-1]:
+        y[..., shift:] += a**shift * y[..., :-shift]
+        shift *= 2
+    return y
+
+
+class DrydenTurbulence:
+    # continuous turbulence from filtered white noise (MIL-F-8785C Dryden forms)
+    #   horizontal: H_u(s) ~ 1 / (1 + (L_u/V) s)
+    #   vertical:   H_w(s) ~ (1 + sqrt(3) (L_w/V) s) / (1 + (L_w/V) s)^2
+    # both discretised with first order sections and scaled so the output
+    # has the requested standard deviation. Samples are generated a block at
+    # a time for n independent streams and served one step at a time. A block
+    # is never written after it is generated, so copies share it.
+    def __init__(
+        self,
+        intensity,
+        length_scale=(50.0, 10.0),
+        airspeed=1.0,
+        dt=1.0 / 60,
+        n=1,
+        block_size=4096,
+        seed=None,
+    ):
+        self.intensity = np.broadcast_to(np.asarray(intensity, dtype=float), (2,))
+        self.length_scale = np.broadcast_to(np.asarray(length_scale, dtype=float), (2,))
+        self.airspeed = max(float(airspeed), 0.1)
+        self.dt = dt
+        self.n = n
+        self.block_size = block_size
+        self.rng = np.random.default_rng(seed)
+
+        tau = self.length_scale / self.airspeed
+        self.a = np.exp(-dt / tau)
+        self.derivative_gain = np.sqrt(3) * tau[1] / dt
+
+        # unit impulse responses of the horizontal section and the two
+        # vertical sections, long enough to have decayed
+        impulse = np.zeros(int(min(20 * tau.max() / dt, 1e6)) + 1)
+        impulse[0] = 1
+        h_u = first_order_filter(impulse, self.a[0], 0)
+        h_w1 = first_order_filter(impulse, self.a[1], 0)
+        h_w2 = first_order_filter(h_w1, self.a[1], 0)
+        h_w = h_w2 + self.derivative_gain * np.diff(h_w2, prepend=0)
+        self.gain = self.intensity / np.sqrt([(h_u**2).sum(), (h_w**2).sum()])
+
+        # filter states per stream: horizontal section, the two vertical
+        # sections and the previous vertical section output. They start from
+        # their stationary distribution so there is no start-up transient.
+        w_covariance = np.array(
+            [
+                [(h_w1**2).sum(), (h_w1 * h_w2).sum()],
+                [(h_w1 * h_w2).sum(), (h_w2**2).sum()],
+            ]
+        )
+        self.state = np.empty((n, 4))
+        self.state[:, 0] = self.rng.standard_normal(n) * np.sqrt((h_u**2).sum())
+        self.state[:, 1:3] = (
+            self.rng.standard_normal((n, 2)) @ np.linalg.cholesky(w_covariance).T
+        )
+        self.state[:, 3] = self.state[:, 2]
+
+        self.fill()
+
+    def filter(self, noise_u, noise_w, state):
+        # filter a block of unit white noise, updating state in place.
+        # returns (n, block, 2) turbulence samples
+        a_u, a_w = self.a
+        u = first_order_filter(noise_u, a_u, state[:, 0])
+        w1 = first_order_filter(noise_w, a_w, state[:, 1])
+        w2 = first_order_filter(w1, a_w, state[:, 2])
+        previous = np.concatenate([state[:, 3:4], w2[:, :-1]], axis=1)
+        w = w2 + self.derivative_gain * (w2 - previous)
+
+        state[:, 0] = u[:, -1]
+        state[:, 1] = w1[:, -1]
+        state[:, 2] = w2[:, -1]
+        state[:, 3] = w2[:, -1]
+        return np.stack([u, w], axis=2) * self.gain
+
+    def fill(self):
+        # keep what is needed to regenerate this block for snapshots
+        self.block_state = self.state.copy()
+        self.block_rng_state = self.rng.bit_generator.state
+        noise = self.rng.standard_normal((2, self.n, self.block_size))
+        self.buffer = self.filter(noise[0], noise[1], self.state)
+        self.index = 0
+
+    def sample(self):
+        # next (n, 2) turbulence vector
+        if self.buffer is None:
+            # restored into another block, regenerate it from its start
+            index = self.index
+            self.fill()
+            self.index = index
+        if self.index == self.block_size:
+            self.fill()
+        value = self.buffer[:, self.index]
+        self.index += 1
+        return value
+
+    def copy(self):
+        # shares the block, the filter state and generator are advanced by
+        # fill() so every copy needs its own
+        turbulence = copy.copy(self)
+        turbulence.state = self.state.copy()
+        turbulence.rng = np.random.default_rng()
+        turbulence.rng.bit_generator.state = self.rng.bit_generator.state
+        return turbulence
+
+    def block_start(self):
+        # filter state and generator state at the start of the current block
+        rng_state = self.block_rng_state["state"]
+        words = [
+            (value >> shift) & 0xFFFFFFFF
+            for value in (rng_state["state"], rng_state["inc"])
+            for shift in (0, 32, 64, 96)
+        ]
+        return [
+            *self.block_state.ravel().tolist(),
+            *words,
+            self.block_rng_state["has_uint32"],
+            self.block_rng_state["uinteger"],
+        ]
+
+    def snapshot(self):
+        # position in the block and block_start(), as a flat list of floats
+        return [self.index, *self.block_start()]
+
+    def restore(self, values):
+        # inverse of snapshot(), returns the number of values consumed. Within
+        # the current block only the position changes, another block is
+        # regenerated by the next sample()
+        size = 1 + 4 * self.n
+        self.index = int(values[0])
+        if list(values[1 : size + 10]) == self.block_start():
+            return size + 10
+        words = [int(v) for v in values[size : size + 8]]
+        state = sum(w << shift for w, shift in zip(words[:4], (0, 32, 64, 96)))
+        inc = sum(w << shift for w, shift in zip(words[4:], (0, 32, 64, 96)))
+        self.rng = np.random.default_rng()
+        self.rng.bit_generator.state = {
+            "bit_generator": "PCG64",
+            "state": {"state": state, "inc": inc},
+            "has_uint32": int(values[size + 8]),
+            "uinteger": int(values[size + 9]),
+        }
+        self.state = np.array(values[1:size], dtype=float).reshape(self.n, 4)
+        self.block_state = self.state.copy()
+        self.block_rng_state = self.rng.bit_generator.state
+        self.buffer = None
+        return size + 10
+
+
 class Wind:
-    def __init__(self, max_steady_state=15, max_gust=0, k_gusts=0):
+    def __init__(
+        self,
+        max_steady_state=15,
+        max_gust=0,
+        k_gusts=0,
+        turbulence_intensity=0,
+        turbulence_length=(50.0, 10.0),
+        seed=None,
+    ):
         self.max_steady_state = max_steady_state
         self.max_gust = max_gust
         self.k_gusts = k_gusts
+        self.turbulence_intensity = turbulence_intensity
+        self.turbulence_length = turbulence_length
+
+        # own generators so that winds do not share the global random state,
+        # a seed of None draws fresh entropy
+        self.seed = seed
+        state = np.random.SeedSequence(seed).generate_state(4)
+        self.rng = random.Random(int.from_bytes(state.tobytes(), "little"))
 
         self.steady_state_on = True
         self.gusts_on = True
+        self.turbulence_on = True
 
         if self.max_steady_state == 0:
             self.steady_state_on = False
         if self.max_gust == 0:
             self.gusts_on = False
+        if np.all(np.asarray(self.turbulence_intensity) == 0):
+            self.turbulence_on = False
 
         self.current_wind = math.Vector2(0, 0)
         self.t = 0
@@ -54,15 +234,24 @@ class Wind:
         # fill in all values in the wind array
         if self.steady_state_on:
             # set the steady state
-            random.seed()
-            angle = random.uniform(
+            angle = self.rng.uniform(
                 0.25 * np.pi, 0.75 * np.pi
             )  # limit to 45 degrees above and below level
-            sign = random.choice([-1, 1])
+            sign = self.rng.choice([-1, 1])
             angle = angle * sign
             self.current_wind = math.Vector2(
-                random.uniform(0, self.max_steady_state) * np.sin(angle),
-                random.uniform(0, self.max_steady_state) * np.cos(angle),
+                self.rng.uniform(0, self.max_steady_state) * np.sin(angle),
+                self.rng.uniform(0, self.max_steady_state) * np.cos(angle),
+            )
+
+        if self.turbulence_on:
+            # the turbulence is convected past the drone by the steady wind
+            self.turbulence = DrydenTurbulence(
+                self.turbulence_intensity,
+                self.turbulence_length,
+                airspeed=max(self.current_wind.magnitude(), 1.0),
+                # drawn from the wind's generator, so its snapshot covers it
+                seed=self.rng.getrandbits(128),
             )
 
         if self.gusts_on:
@@ -76,15 +265,15 @@ class Wind:
         # on the time elapsed since the last gust addition
 
         # 1/K_gusts+.1 = ~0.1-1s
-        if (self.t - self.last_gust_t0) > random.uniform(0, 1 / (self.k_gusts + 0.1)):
+        if (self.t - self.last_gust_t0) > self.rng.uniform(0, 1 / (self.k_gusts + 0.1)):
             return 1
         else:
             return 0
 
     def new_gust(self):
         # make a new gust
-        theta = random.uniform(0, 2 * np.pi)
-        wg0 = random.uniform(0, self.max_gust)
+        theta = self.rng.uniform(0, 2 * np.pi)
+        wg0 = self.rng.uniform(0, self.max_gust)
         lg = self.loguniform(0.1, 2)
         if self.t == 0:
             t0 = self.loguniform(-lg, 0)  # offset for how far along in time the gust is
@@ -128,8 +317,36 @@ class Wind:
         # perform any time-stepping updates to the wind field
         current_gust = self.step(dt)
 
+        if self.turbulence_on:
+            turbulence = self.turbulence.sample()[0]
+            current_gust += math.Vector2(turbulence[0], turbulence[1])
+
         return self.current_wind + current_gust
 
+    def snapshot(self):
+        # time, gust timer, steady wind, turbulence and the active gusts as a
+        # flat list
+        values = [self.t, self.last_gust_t0, self.current_wind.x, self.current_wind.y]
+        if self.turbulence_on:
+            values.extend(self.turbulence.snapshot())
+        values.append(len(self.gust_params))
+        for gust_entry in self.gust_params:
+            values.extend(gust_entry)
+        return values
+
+    def restore(self, values):
+        # inverse of snapshot(), returns the number of values consumed
+        self.t, self.last_gust_t0 = values[0], values[1]
+        self.current_wind = math.Vector2(values[2], values[3])
+        i = 4
+        if self.turbulence_on:
+            i += self.turbulence.restore(values[i:])
+        n_gusts = int(values[i])
+        self.gust_params = [
+            list(values[i + 1 + 4 * j : i + 5 + 4 * j]) for j in range(n_gusts)
+        ]
+        return i + 1 + 4 * n_gusts
+
     def loguniform(self, low, high):
         # random loguniform number from range expressed in linear scale
-        return np.exp(random.uniform(np.log(low), np.log(high)))
+        return np.exp(self.rng.uniform(np.log(low), np.log(high)))
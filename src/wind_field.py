@@ -0,0 +1,194 @@
+# gridded, time varying wind field over the arena
+#
+# the field is a (T, ny, nx, 2) float32 array of wind vectors on a regular
+# grid covering the 8x8 m arena, one frame per time step. It is generated
+# once (optionally straight into a .npy file that is memory mapped for long
+# scenarios) and queried with bilinear interpolation for one or many
+# positions, so the per-step cost is a single gather.
+#
+# generation: a periodic tile of spatially smoothed noise evolves in time as
+# a first order (AR(1)) process and is convected over the arena by the mean
+# wind (frozen turbulence with slow decorrelation).
+import json
+import numpy as np
+from .wind import first_order_filter
+
+
+class WindField:
+    def __init__(self, data, dt=1.0 / 60, extent=8.0):
+        """
+        Args:
+            data (np.ndarray): (T, ny, nx, 2) wind vectors, may be a memmap
+            dt (float, optional): time between frames
+            extent (float, optional): side of the square area covered, in metres
+        """
+        self.data = data
+        self.dt = dt
+        self.extent = extent
+        self.n_frames, self.ny, self.nx, _ = data.shape
+        self.spacing = np.array(
+            [extent / (self.nx - 1), extent / (self.ny - 1)], dtype=float
+        )
+        self.upper = np.array([self.nx - 1, self.ny - 1]) - 1e-9
+
+    @classmethod
+    def generate(
+        cls,
+        duration,
+        dt=1.0 / 60,
+        extent=8.0,
+        resolution=0.5,
+        mean_wind=(2.0, 0.0),
+        intensity=1.0,
+        length_scale=2.0,
+        time_scale=5.0,
+        tile_size=64,
+        path=None,
+        seed=None,
+        chunk=256,
+    ):
+        """Generate a field, in memory or into a memory mapped .npy file.
+
+        Args:
+            duration (float): length of the scenario in seconds
+            dt (float, optional): time between frames
+            extent (float, optional): side of the arena in metres
+            resolution (float, optional): grid spacing in metres
+            mean_wind (tuple, optional): steady wind, also the convection velocity
+            intensity (float, optional): std of the fluctuations per component
+            length_scale (float, optional): spatial correlation length in metres
+            time_scale (float, optional): correlation time of the evolving pattern
+            tile_size (int, optional): cells per side of the periodic noise tile
+            path (str, optional): .npy file to write, metadata goes next to it
+            seed (optional): seed for the noise
+            chunk (int, optional): frames generated per vectorized batch
+        """
+        rng = np.random.default_rng(seed)
+        n_frames = int(np.ceil(duration / dt))
+        n = int(round(extent / resolution)) + 1
+        shape = (n_frames, n, n, 2)
+        if path is None:
+            data = np.empty(shape, dtype=np.float32)
+        else:
+            data = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.float32, shape=shape
+            )
+            with open(str(path) + ".json", "w") as file:
+                json.dump({"dt": dt, "extent": extent}, file)
+
+        # gaussian smoothing kernel in the frequency domain of the tile
+        ky = np.fft.fftfreq(tile_size, d=resolution)[:, None]
+        kx = np.fft.rfftfreq(tile_size, d=resolution)[None, :]
+        kernel = np.exp(-2 * (np.pi * length_scale) ** 2 * (kx**2 + ky**2))
+        # unit white noise through the kernel has the variance of its response
+        response = np.fft.irfft2(kernel, s=(tile_size, tile_size))
+        scale = intensity / np.sqrt((response**2).sum())
+
+        # AR(1) in time: y[k] = a y[k-1] + (1 - a) x[k], rescaled to unit variance
+        a = np.exp(-dt / time_scale)
+        ar_gain = np.sqrt((1 + a) / (1 - a))
+        pattern = rng.standard_normal((2, tile_size, tile_size))
+
+        # grid nodes in tile cells
+        nodes = np.arange(n) * (extent / (n - 1)) / resolution
+        node_x, node_y = np.meshgrid(nodes, nodes)
+        mean_wind = np.asarray(mean_wind, dtype=float)
+
+        for start in range(0, n_frames, chunk):
+            stop = min(start + chunk, n_frames)
+            noise = rng.standard_normal((stop - start, 2, tile_size, tile_size))
+            evolved = first_order_filter(
+                np.moveaxis(noise, 0, -1), a, pattern / ar_gain
+            )
+            evolved = np.moveaxis(evolved, -1, 0) * ar_gain
+            pattern = evolved[-1]
+
+            # smooth each frame and scale to the requested intensity
+            smooth = np.fft.irfft2(
+                np.fft.rfft2(evolved) * kernel, s=(tile_size, tile_size)
+            )
+            smooth *= scale
+
+            # convect: sample the tile upstream of every grid node
+            t = np.arange(start, stop)[:, None, None] * dt
+            source_x = (node_x - mean_wind[0] * t / resolution) % tile_size
+            source_y = (node_y - mean_wind[1] * t / resolution) % tile_size
+            frames = cls._bilinear_periodic(smooth, source_x, source_y)
+            data[start:stop] = frames + mean_wind
+
+        if path is not None:
+            data.flush()
+        return cls(data, dt, extent)
+
+    @staticmethod
+    def _bilinear_periodic(tiles, x, y):
+        # tiles (F, 2, P, P) indexed [frame, component, y, x]; x, y (F, ny, nx)
+        size = tiles.shape[-1]
+        x0 = np.floor(x).astype(int)
+        y0 = np.floor(y).astype(int)
+        fx = (x - x0)[..., None]
+        fy = (y - y0)[..., None]
+        x1 = (x0 + 1) % size
+        y1 = (y0 + 1) % size
+        x0 %= size
+        y0 %= size
+        f = np.arange(tiles.shape[0])[:, None, None]
+        values = np.moveaxis(tiles, 1, -1)  # (F, P, P, 2)
+        return (
+            values[f, y0, x0] * (1 - fx) * (1 - fy)
+            + values[f, y0, x1] * fx * (1 - fy)
+            + values[f, y1, x0] * (1 - fx) * fy
+            + values[f, y1, x1] * fx * fy
+        )
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # open a field written by generate(path=...)
+        with open(str(path) + ".json") as file:
+            metadata = json.load(file)
+        data = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(data, metadata["dt"], metadata["extent"])
+
+    def frame(self, t):
+        # frame index at time t, looping once the scenario is over
+        return int(t / self.dt + 1e-9) % self.n_frames
+
+    def sample(self, t, positions):
+        """Wind at time t for one (2,) or many (N, 2) positions in metres.
+
+        Positions outside of the arena are clamped to its edge.
+        """
+        positions = np.asarray(positions, dtype=float)
+        single = positions.ndim == 1
+        positions = positions.reshape(-1, 2)
+
+        # written per component, broadcasting over the short axis is slow
+        gx = np.clip(positions[:, 0] / self.spacing[0], 0, self.upper[0])
+        gy = np.clip(positions[:, 1] / self.spacing[1], 0, self.upper[1])
+        ix = gx.astype(int)
+        iy = gy.astype(int)
+        fx = gx - ix
+        fy = gy - iy
+
+        # flat index of the lower corner of every cell, one frame is small
+        # enough to read whole before gathering
+        frame = np.asarray(self.data[self.frame(t)], dtype=float)
+        i00 = iy * self.nx + ix
+        i10 = i00 + 1
+        i01 = i00 + self.nx
+        i11 = i01 + 1
+        w00 = (1 - fx) * (1 - fy)
+        w10 = fx * (1 - fy)
+        w01 = (1 - fx) * fy
+        w11 = fx * fy
+
+        wind = np.empty((len(positions), 2))
+        for d in range(2):
+            values = frame[..., d].ravel()
+            wind[:, d] = (
+                values[i00] * w00
+                + values[i10] * w10
+                + values[i01] * w01
+                + values[i11] * w11
+            )
+        return wind[0] if single else wind